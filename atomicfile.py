@@ -0,0 +1,26 @@
+import os
+import threading
+from pathlib import Path
+
+#############################################################################
+# Atominen tiedostoon kirjoitus
+#############################################################################
+
+def write_atomic(path, data):
+    """Write data (str or bytes) to path so that readers only ever see the old or the new file.
+
+    The data goes to a temporary file next to path, named after this process
+    and thread so concurrent writers never share one, and is then renamed
+    over path.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        if isinstance(data, str):
+            tmp.write_text(data, encoding="utf-8")
+        else:
+            tmp.write_bytes(data)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
@@ -11,7 +11,7 @@ import time
 import sys
 import re
 from itertools import batched
-from database import init_db
+from database import init_db, transaction, close_db
 from pathlib import Path
 from pptx import Presentation
 from pptxhandler import get_slide_shapes, get_shape_markdown, markdown_to_shape, is_smart_art
@@ -31,13 +31,38 @@ def lang_code_to_text(code):
     return mapping.get(code.strip().lower(), "Klingon")
 
 
+#############################################################################
+# TLB CACHE
+#############################################################################
+
+class TLBCache:
+    """The TLB of each language, read from the database once and kept in memory.
+
+    Text collection and building the translated files look up every shape,
+    with the cache that is a dictionary lookup instead of a query. New
+    translations are added with add() so both phases see them.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self._languages = {}
+
+    def language(self, lang) -> dict:
+        """{fingerprint: target_text} of one language."""
+        if lang not in self._languages:
+            rows = self.conn.execute("SELECT fingerprint, target_text FROM tlb WHERE lang_code=?", (lang,))
+            self._languages[lang] = dict(rows)
+        return self._languages[lang]
+
+    def add(self, lang, fingerprint, target_text):
+        if lang in self._languages:
+            self._languages[lang][fingerprint] = target_text
+
 #############################################################################
 # TEXT COLLECTION FOR TRANSLATION
 #############################################################################
 
-def collect_texts_from_pptx(file_path, languages,conn,list_of_texts):
+def collect_texts_from_pptx(file_path, languages,tlb,list_of_texts):
     path = Path(file_path)
-    cursor = conn.cursor()
     
     # Get original file's last modified time
     orig_mtime = path.stat().st_mtime
@@ -60,6 +85,7 @@ def collect_texts_from_pptx(file_path, languages,conn,list_of_texts):
 
         print(f"[{lang}] {ppath} ==> {ptrans_path}. Updated or translation missing. Collecting strings to translate...")
         prs = Presentation(path)
+        translations = tlb.language(lang)
 
         ###############################################
         # COLLECT TEXTS TO TRANSLATE FROM ALL SLIDES
@@ -78,9 +104,7 @@ def collect_texts_from_pptx(file_path, languages,conn,list_of_texts):
                 text = get_shape_markdown(shape_map[shape_id]).strip()
                 if not text:
                     continue
-                cursor.execute("SELECT EXISTS(SELECT 1 FROM tlb WHERE fingerprint=? AND lang_code=?)", (fingerprint,lang))
-                exists = cursor.fetchone()[0]  
-                if not exists:
+                if fingerprint not in translations:
                     list_of_texts[lang].append( {"id": fingerprint, "text": text, "translation": ""})
             #n += 1
 
@@ -88,10 +112,8 @@ def collect_texts_from_pptx(file_path, languages,conn,list_of_texts):
 # TRANSLATION OF TEXT BATCHES
 #############################################################################
 
-def translate_texts(translation_texts, batch_size, prompt, model, conn):
+def translate_texts(translation_texts, batch_size, prompt, model, conn, tlb):
 
-    cursor = conn.cursor()
-    
     for lang, texts in translation_texts.items():
         language_name = lang_code_to_text(lang)
         # Determine suitable batch size
@@ -119,8 +141,8 @@ def translate_texts(translation_texts, batch_size, prompt, model, conn):
                 print(f"\n[ERROR] AI Translation failed unexpectedly: {e}")
                 ai_results = translate_now
 
-            # Open the SQL fix file in append mode
-            with open("fix_translations.sql", "a", encoding="utf-8") as sql_file:
+            # Open the SQL fix file in append mode, the TLB inserts of the batch are committed together
+            with open("fix_translations.sql", "a", encoding="utf-8") as sql_file, transaction(conn) as cursor:
                 #for shape_id, fingerprint, original_markdown, translated_markdown in ai_results:
                 for entry in ai_results:
                     if entry["translation"] == "" or entry["translation"] is None:
@@ -133,12 +155,12 @@ def translate_texts(translation_texts, batch_size, prompt, model, conn):
                         sql_file.write(f"/* INSERT MANUAL TRANSLATION!!!\n ORIG: {entry["text"]}\n*/\n")
                         sql_file.write(f"INSERT OR REPLACE INTO tlb (fingerprint, source_text, target_text, lang_code) VALUES ('{entry["id"]}', '{entry["text"]}', 'INSERT MANUAL TRANSLATION HERE', '{lang}');\n")
                     else:
-                        # --- Update TLB and commit ---
+                        # --- Update TLB, committed at the end of the batch ---
                         cursor.execute(    
                             "INSERT OR REPLACE INTO tlb (fingerprint, source_text, target_text, lang_code) VALUES (?, ?, ?, ?)",
                             (entry["id"], entry["text"], entry["translation"], lang)
                         )
-                        conn.commit()
+                        tlb.add(lang, entry["id"], entry["translation"])
 
                         # --- Generate SQL Fix Line ---
                         # We escape single quotes for SQL safety
@@ -155,9 +177,8 @@ def translate_texts(translation_texts, batch_size, prompt, model, conn):
 # CREATING TRANSLATED FILES
 ###############################################
 
-def create_translated_pptx(file_path, languages,conn):
+def create_translated_pptx(file_path, languages,tlb):
     path = Path(file_path)
-    cursor = conn.cursor()
     
     # Get original file's last modified time
     orig_mtime = path.stat().st_mtime
@@ -178,6 +199,7 @@ def create_translated_pptx(file_path, languages,conn):
             continue
 
         prs = Presentation(path)
+        translations = tlb.language(lang)
 
         for slide in prs.slides:
             shape_map = {s.shape_id: s for s in slide.shapes if hasattr(s, "text")}
@@ -190,11 +212,10 @@ def create_translated_pptx(file_path, languages,conn):
                 text = get_shape_markdown(shape_map[shape_id]).strip()
                 if not text:
                     continue
-                cursor.execute("SELECT target_text FROM tlb WHERE fingerprint=?", (fingerprint,))
-                row = cursor.fetchone()
+                target_text = translations.get(fingerprint)
                 #push markdown into shape
-                if row:
-                    markdown_to_shape(shape_map[shape_id], row[0])            
+                if target_text is not None:
+                    markdown_to_shape(shape_map[shape_id], target_text)
                 else:
                     translation_ok = False
                     break
@@ -224,6 +245,7 @@ if __name__ == "__main__":
     if not silent:
         print("Config loaded successfully!")
     db = init_db()
+    tlb = TLBCache(db)
     
     #Initialise genAI
     model = getAI(AI=config["gen_ai"]["AI"],api_key=config["gen_ai"]["API_KEY"],model=config["gen_ai"]["Model"],timeout=config["gen_ai"]["Request_timeout_ms"],maxperminute=config["gen_ai"]["Max_requests_per_minute"])
@@ -265,12 +287,14 @@ if __name__ == "__main__":
             files.append(next((p for p in Path(config[pub]['course_slides_dir']).glob(f"*{n:02d}*.pptx") if not re.search(r'_[a-zA-Z]{2}\.pptx$', p.name)), None))
         # Collect texts:
         for f in files:
-            collect_texts_from_pptx(f, languages,db, texts_to_translate)
+            collect_texts_from_pptx(f, languages,tlb, texts_to_translate)
 
         # Make translations for this publication
-        translate_texts(texts_to_translate,int(config['gen_ai']['batch_size']), config[pub]['ai_prompt'], model,db)
+        translate_texts(texts_to_translate,int(config['gen_ai']['batch_size']), config[pub]['ai_prompt'], model,db,tlb)
 
         # Make translated files:
         for f in files:
-            create_translated_pptx(f,languages,db)
+            create_translated_pptx(f,languages,tlb)
+
+    close_db()
 
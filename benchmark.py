@@ -0,0 +1,230 @@
+import argparse
+import io
+import json
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from reportlab.pdfgen import canvas
+
+#############################################################################
+# Suorituskykymittaukset synteettisellä kurssiaineistolla
+#############################################################################
+
+BASELINE_FILE = Path("benchmark_baseline.json")
+PAGE_SIZE = (960, 540)
+
+def make_image(seed: int, size: int = 400):
+    """A random JPEG for the slides, None if Pillow is not installed."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    rnd = random.Random(seed)
+    img = Image.effect_noise((size, size), 64).convert("RGB")
+    img = Image.blend(img, Image.new("RGB", (size, size), (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256))), 0.5)
+    data = io.BytesIO()
+    img.save(data, "JPEG", quality=90)
+    data.seek(0)
+    return data
+
+def make_pdf(path: Path, title: str, pages: int, links: int, image=None, seed: int = 0):
+    """Write a slide deck with text, an optional shared image and link annotations on every page."""
+    from reportlab.lib.utils import ImageReader
+    c = canvas.Canvas(str(path), PAGE_SIZE)
+    reader = ImageReader(image) if image is not None else None
+    for page in range(pages):
+        c.setFont("Helvetica", 28)
+        c.drawString(60, 470, f"{title} – {page + 1}")
+        c.setFont("Helvetica", 14)
+        for line in range(10):
+            c.drawString(60, 420 - line * 24, f"Lorem ipsum {seed}-{page}-{line} dolor sit amet, consectetur adipiscing elit.")
+        if reader is not None:
+            c.drawImage(reader, 600, 100, 300, 300)
+        for link in range(links):
+            y = 60 + link * 12
+            c.linkURL(f"https://example.invalid/{seed}/{page}/{link}", (60, y, 300, y + 10), relative=0)
+        c.showPage()
+    c.save()
+
+def generate_corpus(root: Path, topics: int, pages: int, lectures: int, languages: list, links: int, images: bool) -> Path:
+    """Generate a course tree and a matching settings.ini under root, returns root."""
+    if root.exists():
+        shutil.rmtree(root)
+    lecture_dir = root / "lecture_slides"
+    course_dir = root / "course_slides"
+    publish_dir = root / "publish"
+    for d in (lecture_dir, course_dir, publish_dir):
+        d.mkdir(parents=True)
+    image = make_image(1) if images else None
+    suffixes = [""] + [f"_{lang}" for lang in languages]
+    for suffix in suffixes:
+        for t in range(topics):
+            if image is not None:
+                image.seek(0)
+            make_pdf(lecture_dir / f"topic{t:03}{suffix}.pdf", f"Aihe {t}", pages, links, image, seed=t)
+        for name in ("header", "divider", "footer"):
+            if image is not None:
+                image.seek(0)
+            make_pdf(course_dir / f"{name}{suffix}.pdf", name, 2, 0, image)
+        for n in range(1, lectures + 1):
+            make_pdf(course_dir / f"{n:02} kurssi{suffix}.pdf", f"Kurssi {n}", 1, 0)
+    per_lecture = max(1, topics // lectures)
+    lecture_lines = []
+    for n in range(1, lectures + 1):
+        first = ((n - 1) * per_lecture) % topics
+        names = [f"topic{(first + i) % topics:03}" for i in range(per_lecture)]
+        lecture_lines.append(f"{n} = Luento numero {n} pitkällä otsikolla synteettisestä aineistosta; {'; '.join(names)}")
+        (lecture_dir / f"{n:02}").mkdir()
+        (lecture_dir / f"{n:02}" / "harjoitus.txt").write_text(f"Harjoitus {n}\n")
+    (root / "settings.ini").write_text(f"""[settings]
+lecture_slides_dir = {lecture_dir}
+headerfile = header
+footerfile = footer
+dividerfile = divider
+
+[gen_ai]
+AI = Google
+API_KEY = none
+model = none
+batch_size = 50
+request_timeout_ms = 1000
+max_requests_per_minute = 10
+
+[titlefont]
+font = Helvetica-Bold
+font_max_size = 48
+font_min_size = 20
+colour = white
+maxlines = 3
+
+[Benchmark]
+coursecode = BENCH1
+translate_to = {",".join(languages)}
+ai_prompt = none
+publish_dir = {publish_dir}
+coursesize = 5 op
+lectures = {lectures}
+coursename = Benchmark
+filename_prefix = BENCH
+lectureterm = Luento
+course_slides_dir = {course_dir}
+{chr(10).join(lecture_lines)}
+""", encoding="utf-8")
+    return root
+
+#############################################################################
+# Mittaukset
+#############################################################################
+
+def run_publisher(root: Path, *args):
+    publisher = Path(__file__).resolve().parent / "pdfpublisher.py"
+    result = subprocess.run([sys.executable, str(publisher), "--silent", *args], cwd=root, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"pdfpublisher failed:\n{result.stdout}\n{result.stderr}")
+
+def time_call(func, repeat: int) -> float:
+    """Median wall time of repeat calls in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def bench_full_rebuild(root: Path, jobs: int):
+    def run():
+        shutil.rmtree(root / "publish", ignore_errors=True)
+        shutil.rmtree(root / ".pdfpublisher_cache", ignore_errors=True)
+        (root / "publish").mkdir()
+        run_publisher(root, "--jobs", str(jobs))
+    return run
+
+def bench_noop(root: Path):
+    return lambda: run_publisher(root)
+
+def bench_titles(count: int):
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    from pdfpublisher import render_title
+    titles = [f"Luento {i}: " + " ".join(random.Random(i).choice(["ohjelmisto", "projekti", "tietoturva", "laatu", "testaus", "arkkitehtuuri"]) for _ in range(12)) for i in range(count)]
+    def run():
+        for i, title in enumerate(titles):
+            render_title(PAGE_SIZE[0], PAGE_SIZE[1], "Luento", i, title, "Helvetica-Bold", 48, 20, "white", 3)
+    return run
+
+def bench_links(root: Path):
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    from utils import find_links
+    files = sorted((root / "lecture_slides").glob("*.pdf"))
+    def run():
+        for f in files:
+            find_links(str(f))
+    return run
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Names of the measurements that are slower than the baseline by more than tolerance."""
+    regressions = []
+    for name, value in results.items():
+        base = baseline.get(name)
+        if base and value > base * (1 + tolerance):
+            regressions.append(name)
+    return regressions
+
+#############################################################################
+# MAIN
+#############################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PDF Publisher benchmarks")
+    parser.add_argument("--topics", type=int, default=20, help="Number of topic PDFs")
+    parser.add_argument("--pages", type=int, default=10, help="Pages per topic PDF")
+    parser.add_argument("--lectures", type=int, default=5, help="Number of lectures")
+    parser.add_argument("--languages", default="en,sv", help="Translations, separated by ,")
+    parser.add_argument("--links", type=int, default=5, help="Link annotations per page")
+    parser.add_argument("--no-images", action="store_true", help="Do not embed images")
+    parser.add_argument("--jobs", type=int, default=1, help="Value of --jobs for the full rebuild")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions per measurement, the median is reported")
+    parser.add_argument("--workdir", type=str, help="Where to generate the corpus (default: temporary folder)")
+    parser.add_argument("--baseline", type=str, default=str(BASELINE_FILE), help="Baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown against the baseline, 0.2 = 20 %%")
+    args = parser.parse_args()
+
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix="pdfpublisher-bench-"))
+    languages = [lang.strip() for lang in args.languages.split(",") if lang.strip()]
+    print(f"Generoidaan aineisto: {args.topics} aihetta x {args.pages} sivua, {len(languages) + 1} kieltä -> {workdir}")
+    root = generate_corpus(workdir / "corpus", args.topics, args.pages, args.lectures, languages, args.links, not args.no_images)
+
+    results = {}
+    results["full_rebuild_s"] = time_call(bench_full_rebuild(root, args.jobs), args.repeat)
+    results["noop_run_s"] = time_call(bench_noop(root), args.repeat)
+    results["title_render_s"] = time_call(bench_titles(50), args.repeat)
+    results["link_extract_s"] = time_call(bench_links(root), args.repeat)
+
+    corpus = {"topics": args.topics, "pages": args.pages, "lectures": args.lectures,
+              "languages": languages, "links": args.links, "images": not args.no_images, "jobs": args.jobs}
+    baseline_path = Path(args.baseline)
+    baseline = {}
+    if baseline_path.exists():
+        stored = json.loads(baseline_path.read_text())
+        if stored.get("corpus") == corpus:
+            baseline = stored["results"]
+        else:
+            print(f"[WARNING] Baseline {baseline_path} was measured with a different corpus, not comparing")
+    regressions = compare(results, baseline, args.tolerance)
+    for name, value in results.items():
+        base = baseline.get(name)
+        change = f" ({(value / base - 1) * 100:+.0f}% vs. baseline)" if base else ""
+        flag = "  <-- REGRESSIO" if name in regressions else ""
+        print(f"{name:>16}: {value:8.3f}{change}{flag}")
+
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps({"corpus": corpus, "results": results}, indent=2))
+        print(f"Baseline tallennettu: {baseline_path}")
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,250 @@
+import json
+import re
+from pathlib import Path
+from classes import create_course_object
+from dirindex import directory_index
+from images import image_settings
+
+#############################################################################
+# Käännössuunnitelma: mitä julkaistaan ja miksi, avaamatta yhtään PDF:ää
+#############################################################################
+
+def languages(config, pub) -> list:
+    """Languages of a publication, "" is the untranslated original."""
+    langs = [""]
+    if not config[pub]['translate_to'] == "":
+        langs += config[pub]['translate_to'].split(",")
+    return langs
+
+def lecture_dir(courseObject, n) -> str:
+    return f"{courseObject.publication_dir}/{courseObject.lectureterm} {n:02}"
+
+def output_filename(courseObject, n, suffix) -> str:
+    return re.sub(r'[\\/]', '', f"{n:02} - {courseObject.filename_prefix} {courseObject.lectureterm.lower()} {n} – {courseObject.lecture_list[n-1].name}{suffix}")[:200]
+
+def lecture_sources(courseObject, config, lang) -> dict:
+    """Where the inputs of one publication and language are, from the directory index."""
+    suffix = f"_{lang}.pdf" if lang != "" else ".pdf"
+    course_files = directory_index.listing(courseObject.course_slides_dir)
+    sources = {"pubslides": directory_index.numbered(courseObject.course_slides_dir, lang),
+               "slide_updates": directory_index.listing(config['settings']['lecture_slides_dir']),
+               "suffix": suffix}
+    for role in ("header", "divider", "footer"):
+        name = f"{config['settings'][role + 'file']}{suffix}"
+        sources[role] = Path(courseObject.course_slides_dir) / name
+        sources[f"{role}_ok"] = name in course_files
+    return sources
+
+def plan_lecture_output(courseObject, config, pub, lang, n, sources, manifest) -> dict:
+    """Plan one (publication, language, lecture) output.
+
+    The returned entry lists the inputs in page order, which of them are
+    missing, whether the output is dirty and why. A dirty entry has everything
+    needed to assemble the lecture. Only files whose size or mtime changed are
+    read to hash them, no PDF is parsed.
+    """
+    lecture = courseObject.lecture_list[n-1]
+    suffix = sources["suffix"]
+    slide_updates = sources["slide_updates"]
+    pubslides = sources["pubslides"]
+    matpubdir = lecture_dir(courseObject, n)
+    filename = output_filename(courseObject, n, suffix)
+    output = Path(matpubdir) / filename
+    published = directory_index.listing(matpubdir).get(filename)
+    previous = manifest.get(output) if published else None
+
+    entry = {"kind": "lecture",
+             "pub": pub,
+             "lang": lang,
+             "lecture": n,
+             "label": f"{config[pub]['lectureterm']} {n} ({lecture.name})",
+             "output": str(output),
+             "header": str(sources["header"]),
+             "divider": str(sources["divider"]),
+             "footer": str(sources["footer"]),
+             "topics": [],
+             "course": None,
+             "title": {"lectureterm": courseObject.lectureterm,
+                       "lecturenum": n,
+                       "lecturetitle": lecture.name,
+                       "font": config["titlefont"]["font"],
+                       "font_max_size": int(config["titlefont"]["font_max_size"]),
+                       "font_min_size": int(config["titlefont"]["font_min_size"]),
+                       "font_colour": config["titlefont"]["colour"],
+                       "maxlines": int(config["titlefont"]["maxlines"])},
+             "title_cache": str(Path(config["settings"]["cache_dir"]) / "titles"),
+             "optimize": config["settings"].getboolean("optimize_output"),
+             "memory_budget": int(config["settings"]["memory_budget_mb"]) * 1048576,
+             "images": image_settings(config),
+             "image_cache": str(Path(config["settings"]["cache_dir"]) / "images"),
+             "checks": [],
+             "missing": [],
+             "reasons": [],
+             "dirty": False,
+             "digest": None,
+             "inputs": {}}
+    input_hashes = entry["inputs"]
+
+    def add_input(kind, name, path, modtime):
+        """Hash an input and record whether it changed since the last build."""
+        input_hashes[str(path)] = manifest.file_hash(path)
+        if kind is None:
+            return
+        if previous is None:
+            changed = published is None or modtime > published["modtime"]
+        else:
+            changed = previous["inputs"].get(str(path)) != input_hashes[str(path)]
+        entry["checks"].append({"kind": kind, "name": name, "state": "changed" if changed else "current"})
+        if changed:
+            entry["reasons"].append(f"changed: {name}")
+
+    def add_fixed(role):
+        if sources[f"{role}_ok"]:
+            add_input(None, None, sources[role], None)
+        else:
+            entry["missing"].append(sources[role].name)
+
+    add_fixed("header")
+    for topic in lecture.topic_list:
+        name = f"{topic}{suffix}"
+        if name not in slide_updates:
+            entry["checks"].append({"kind": "topic", "name": name, "state": "missing"})
+            entry["missing"].append(name)
+            entry["topics"].append(None)
+            continue
+        path = slide_updates[name]["file"]
+        entry["topics"].append(str(path))
+        add_input("topic", name, path, slide_updates[name]["modtime"])
+    add_fixed("divider")
+    if n not in pubslides:
+        entry["checks"].append({"kind": "course", "name": f"{n:02}", "state": "missing"})
+        entry["missing"].append(f"{n:02} (course-specific slides)")
+    else:
+        entry["course"] = str(pubslides[n]["file"])
+        add_input("course", pubslides[n]["file"].name, pubslides[n]["file"], pubslides[n]["modtime"])
+    add_fixed("footer")
+
+    if entry["missing"]:
+        entry["reasons"] = ["missing inputs"]
+        return entry
+
+    settings = entry["title"] if entry["images"] is None else {**entry["title"], "images": entry["images"]}
+    entry["digest"] = manifest.digest(input_hashes, settings)
+    if published is None:
+        entry["reasons"].insert(0, "not published")
+    elif previous is None:
+        if not entry["reasons"]:
+            # Published before the manifest existed and up to date by mtime, adopt it
+            manifest.record(output, entry["digest"], input_hashes)
+    elif previous["digest"] != entry["digest"] and not entry["reasons"]:
+        entry["checks"].append({"kind": "settings", "name": None, "state": "changed"})
+        entry["reasons"].append("header, divider, footer, title settings or page order changed")
+    entry["dirty"] = bool(entry["reasons"])
+    return entry
+
+def compendium_filename(courseObject, suffix) -> str:
+    return re.sub(r'[\\/]', '', f"{courseObject.filename_prefix} {courseObject.name}{suffix}")[:200]
+
+def plan_compendium(courseObject, config, pub, lang, sources, manifest) -> dict:
+    """Plan the compendium of one publication and language, None if it is not enabled.
+
+    The compendium contains every lecture in order. Its digest is made of the
+    digests of its member lectures, so it is dirty only when one of them
+    changed, whether or not that lecture itself was republished this run.
+    """
+    if not config[pub].getboolean("compendium"):
+        return None
+    members = [plan_lecture_output(courseObject, config, pub, lang, n, sources, manifest)
+               for n in range(1, len(courseObject.lecture_list)+1)]
+    filename = compendium_filename(courseObject, sources["suffix"])
+    output = Path(courseObject.publication_dir) / filename
+    published = directory_index.listing(courseObject.publication_dir).get(filename)
+    previous = manifest.get(output) if published else None
+    entry = {"kind": "compendium",
+             "pub": pub,
+             "lang": lang,
+             "lecture": "compendium",
+             "label": "Kooste",
+             "output": str(output),
+             "suffix": sources["suffix"],
+             "members": members,
+             "title_cache": str(Path(config["settings"]["cache_dir"]) / "titles"),
+             "optimize": config["settings"].getboolean("optimize_output"),
+             "memory_budget": int(config["settings"]["memory_budget_mb"]) * 1048576,
+             "images": image_settings(config),
+             "image_cache": str(Path(config["settings"]["cache_dir"]) / "images"),
+             "checks": [],
+             "missing": [f"{config[pub]['lectureterm']} {m['lecture']}" for m in members if m["missing"]],
+             "reasons": [],
+             "dirty": False,
+             "digest": None,
+             "inputs": {m["output"]: m["digest"] for m in members}}
+    if entry["missing"]:
+        entry["reasons"] = ["missing inputs"]
+        return entry
+    entry["digest"] = manifest.digest(entry["inputs"], {"compendium": True})
+    if published is None:
+        entry["reasons"].append("not published")
+    elif previous is None or previous["digest"] != entry["digest"]:
+        changed = [m["label"] for m in members if previous is None or previous["inputs"].get(m["output"]) != m["digest"]]
+        entry["reasons"] += [f"changed: {label}" for label in changed] or ["page order changed"]
+    entry["dirty"] = bool(entry["reasons"])
+    return entry
+
+def build_plan(config, publications, manifest) -> list:
+    """Plan every publication, language and lecture in one metadata pass."""
+    plan = []
+    for pub in publications:
+        courseObject = create_course_object(config, pub)
+        for lang in languages(config, pub):
+            sources = lecture_sources(courseObject, config, lang)
+            for n in range(1, len(courseObject.lecture_list)+1):
+                plan.append(plan_lecture_output(courseObject, config, pub, lang, n, sources, manifest))
+            compendium = plan_compendium(courseObject, config, pub, lang, sources, manifest)
+            if compendium is not None:
+                plan.append(compendium)
+    return plan
+
+def plan_inputs(entry) -> list:
+    """Input files of an entry in page order, missing topics left out."""
+    if entry["kind"] == "compendium":
+        return [path for member in entry["members"] for path in plan_inputs(member)]
+    return [entry["header"], *[t for t in entry["topics"] if t], entry["divider"],
+            *([entry["course"]] if entry["course"] else []), entry["footer"]]
+
+def plan_to_json(plan) -> str:
+    outputs = [{"publication": e["pub"],
+                "language": e["lang"] or "fi",
+                "lecture": e["lecture"],
+                "output": e["output"],
+                "inputs": plan_inputs(e),
+                "missing": e["missing"],
+                "dirty": e["dirty"],
+                "reasons": e["reasons"]} for e in plan]
+    summary = {"outputs": len(plan),
+               "dirty": sum(e["dirty"] for e in plan),
+               "blocked": sum(bool(e["missing"]) for e in plan)}
+    return json.dumps({"summary": summary, "outputs": outputs}, ensure_ascii=False, indent=2)
+
+def format_plan(plan) -> str:
+    lines = []
+    for e in plan:
+        if e["missing"]:
+            state = "PUUTTUU"
+        elif e["dirty"]:
+            state = "JULKAISTAAN"
+        else:
+            state = "ajan tasalla"
+        lines.append(f"{e['pub']} [{e['lang'] or 'fi'}] {e['label']}: {state}")
+        lines.append(f"  -> {e['output']}")
+        for path in plan_inputs(e):
+            lines.append(f"  <- {path}")
+        for name in e["missing"]:
+            lines.append(f"  puuttuu: {name}")
+        if e["dirty"]:
+            for reason in e["reasons"]:
+                lines.append(f"  syy: {reason}")
+    dirty = sum(e["dirty"] for e in plan)
+    blocked = sum(bool(e["missing"]) for e in plan)
+    lines.append(f"Yhteensä {len(plan)} tiedostoa, {dirty} julkaistaan, {blocked} odottaa puuttuvia kalvoja")
+    return "\n".join(lines)
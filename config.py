@@ -17,6 +17,38 @@ REQUIRED_SETTINGS = {
         "titlefont": ["font","font_max_size","font_min_size","colour","maxlines"]
 }
 
+# Optional settings and their defaults, these are not written to settings.ini
+OPTIONAL_SETTINGS = {
+	"settings": {"reader_cache_mb": "512",
+	             "cache_dir": ".pdfpublisher_cache",
+	             "staging_dir": ".pdfpublisher_cache/staging",
+	             "upload_workers": "4",
+	             "upload_retries": "3",
+	             "upload_backoff": "2",
+	             "optimize_output": "yes",
+	             "memory_budget_mb": "0",
+	             "image_max_dpi": "0",
+	             "image_jpeg_quality": "80",
+	             "image_min_kb": "64",
+	             "linkextract_workers": "4",
+	             "linkcheck_workers": "16",
+	             "linkcheck_per_host": "4",
+	             "linkcheck_timeout": "5",
+	             "linkcheck_timeout_max": "30",
+	             "linkcheck_breaker_failures": "5",
+	             "linkcheck_ttl_ok_hours": "168",
+	             "linkcheck_ttl_fail_hours": "4",
+	             "watch_mode": "auto",
+	             "watch_interval": "10",
+	             "watch_debounce": "3",
+	             "prune_materials": "no",
+	             "metrics_json": ".pdfpublisher_cache/metrics.json",
+	             "metrics_textfile": ".pdfpublisher_cache/pdfpublisher.prom"}
+}
+
+# Optional options of every publication and their defaults
+OPTIONAL_PUBLICATION_OPTIONS = {"compendium": "no"}
+
 # Mandatory options for all publications
 PUBLICATION_OPTIONS = set(["coursecode", 
 						   "translate_to",
@@ -96,4 +128,16 @@ def load_config():
     if len(publications) == 0:
         print(f"[ERROR] At least one publication required! Added empty one to {CONFIG_FILE}!")
         sys.exit(1)	
+
+    # Fill in defaults for optional settings
+    for section, options in OPTIONAL_SETTINGS.items():
+        if not config.has_section(section):
+            config.add_section(section)
+        for key, value in options.items():
+            if not config.has_option(section, key) or not config[section][key].strip():
+                config.set(section, key, value)
+    for pub in publications:
+        for key, value in OPTIONAL_PUBLICATION_OPTIONS.items():
+            if not config.has_option(pub, key) or not config[pub][key].strip():
+                config.set(pub, key, value)
     return (config,publications)
@@ -1,54 +1,144 @@
+import atexit
 import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
 
-def connect_to_db():
-    conn = sqlite3.connect("link_health.db")
-    cur = conn.cursor()
-    cur.execute("PRAGMA foreign_keys = ON;")
-    return cur
+DB_FILE = "translations.db"
 
-def init_db():
-    """
-    Initializes the SQLite database with a focus on the Translation Lookaside Buffer.
+def create_link_tables(cursor):
+    """Create the link status table and migrate rows of the old dead_links log into it.
+
+    link_status holds the current state of every checked link, one row per
+    (url, file, page). first_failed is when the link started failing and
+    fail_count how many checks in a row it has failed, both are cleared when
+    the link works again. inferred is set when the link was marked dead
+    without requesting it because its host had stopped answering. Times are
+    ISO 8601 UTC strings, so they sort and compare as text.
     """
-    with sqlite3.connect("translations.db") as conn:
-        cursor = conn.cursor()
-        
-        # 1. THE TLB (Translation Lookaside Buffer)
-        # This is the 'Brain'. It stores every unique string translation.
-        # fingerprint: md5(source_text + lang_code)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS tlb (
-                fingerprint TEXT,
-                source_text TEXT,
-                target_text TEXT,
-                lang_code TEXT,
-                PRIMARY KEY (fingerprint, lang_code)
-                )
-        ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS link_status (
+            url TEXT NOT NULL,
+            file TEXT NOT NULL,
+            page_number INTEGER NOT NULL,
+            course TEXT,
+            status TEXT NOT NULL,
+            error_code TEXT,
+            response_ms INTEGER,
+            first_failed TEXT,
+            last_checked TEXT NOT NULL,
+            fail_count INTEGER NOT NULL DEFAULT 0,
+            inferred INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (url, file, page_number)
+            )
+    ''')
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(link_status)")]
+    if "inferred" not in columns:
+        cursor.execute("ALTER TABLE link_status ADD COLUMN inferred INTEGER NOT NULL DEFAULT 0")
+    # "Dead links of course X" and "broken since" reports
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_link_status_course ON link_status(course, status)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_link_status_failed ON link_status(status, first_failed)')
+    # Removing the rows of a checked file that were not seen in the last run
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_link_status_file ON link_status(file, last_checked)')
 
-        # Indexing the lang_code makes lookups significantly faster as the DB grows
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tlb_lang ON tlb(lang_code)')
+    exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='dead_links'").fetchone()
+    if exists:
+        # checked_at was YYYY-mm-dd-HH-MM-SS, every row one failed check
+        iso = "substr(checked_at,1,10) || 'T' || replace(substr(checked_at,12,8),'-',':') || 'Z'"
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO link_status (url, file, page_number, status, error_code, first_failed, last_checked, fail_count)
+            SELECT url, file, page_number, 'dead', error_code, MIN({iso}), MAX({iso}), COUNT(*)
+            FROM dead_links WHERE url IS NOT NULL AND file IS NOT NULL AND page_number IS NOT NULL
+            GROUP BY url, file, page_number
+        ''')
+        cursor.execute("DROP TABLE dead_links")
 
-        # 2. FILE TRACKING (Optional but recommended)
-        # Useful for logging when a specific file was last processed successfully.
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS processed_files (
-                file_path TEXT PRIMARY KEY,
-                last_mtime REAL,
-                last_processed REAL
+def create_tables(cursor):
+    """Create every table of the database if it does not exist yet."""
+    # 1. THE TLB (Translation Lookaside Buffer)
+    # This is the 'Brain'. It stores every unique string translation.
+    # fingerprint: md5(source_text + lang_code)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tlb (
+            fingerprint TEXT,
+            source_text TEXT,
+            target_text TEXT,
+            lang_code TEXT,
+            PRIMARY KEY (fingerprint, lang_code)
             )
-        ''')
+    ''')
 
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS dead_links (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            error_code TEXT,
-            file TEXT,
-            url TEXT,
-            page_number INTEGER,
-            checked_at TEXT
-            ) 
-        ''')
-        conn.commit()
-        print(f"Database initialized")
+    # Indexing the lang_code makes lookups significantly faster as the DB grows
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tlb_lang ON tlb(lang_code)')
+
+    # 2. FILE TRACKING (Optional but recommended)
+    # Useful for logging when a specific file was last processed successfully.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS processed_files (
+            file_path TEXT PRIMARY KEY,
+            last_mtime REAL,
+            last_processed REAL
+        )
+    ''')
+
+    # 3. LINK STATUS
+    # Current state of every checked link, see create_link_tables.
+    create_link_tables(cursor)
+
+#############################################################################
+# Jaettu tietokantayhteys: WAL-loki ja yksi commit erää kohden
+#############################################################################
+
+_connections = {}
+_lock = threading.Lock()
+
+def get_db(path=DB_FILE) -> sqlite3.Connection:
+    """The shared connection of this process to the database at path.
+
+    The connection is opened and the tables created on first use, and it
+    stays open until close_db(). It uses write-ahead logging with
+    synchronous=NORMAL: a commit appends to the log without waiting for the
+    disk, only checkpoints are synced. A power loss can lose the last
+    commits but never corrupts the database.
+    """
+    key = str(Path(path).resolve())
+    with _lock:
+        conn = _connections.get(key)
+        if conn is None:
+            conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA foreign_keys = ON")
+            with conn:
+                create_tables(conn.cursor())
+            _connections[key] = conn
+    return conn
+
+@contextmanager
+def transaction(conn: sqlite3.Connection):
+    """Cursor for a batch of writes that is committed once at the end, or rolled back on an error."""
+    with conn:
+        yield conn.cursor()
+
+def close_db():
+    """Commit, checkpoint the write-ahead log into the database file and close every shared connection."""
+    with _lock:
+        for conn in _connections.values():
+            try:
+                conn.commit()
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except sqlite3.Error as e:
+                print(f"[WARNING] Could not checkpoint the database: {e}")
+            conn.close()
+        _connections.clear()
+
+atexit.register(close_db)
+
+def init_db():
+    """
+    Initializes the SQLite database with a focus on the Translation Lookaside Buffer.
+    Returns the shared connection, see get_db().
+    """
+    conn = get_db()
+    print(f"Database initialized")
     return conn
@@ -0,0 +1,105 @@
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from pathlib import Path
+
+#############################################################################
+# Hakemistoindeksi: jokainen kansio luetaan kerran ajon aikana
+#############################################################################
+
+LANG_SUFFIX = re.compile(r"_\w{2}\.pdf$")
+NUMBER = re.compile(r"\d+")
+
+class DirectoryIndex:
+    """In-memory listing of the slide and publication folders.
+
+    Every folder is read once with os.scandir and the queries below are
+    answered from memory. Entries are dicts with "file", "modtime", "size"
+    and "is_dir" like the ones the folder listing has always returned.
+    """
+    def __init__(self, workers: int = 8):
+        self.workers = workers
+        self._dirs = {}
+        self._lock = threading.Lock()
+
+    def _scan(self, directory) -> dict:
+        entries = {}
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        st = entry.stat()
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        continue
+                    entries[entry.name] = {"file": Path(entry.path),
+                                           "modtime": st.st_mtime,
+                                           "size": st.st_size,
+                                           "is_dir": is_dir}
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+        return entries
+
+    def listing(self, directory) -> dict:
+        """All entries of a folder by name, scanned on first use."""
+        key = os.path.normpath(str(directory))
+        with self._lock:
+            entries = self._dirs.get(key)
+        if entries is None:
+            entries = self._scan(key)
+            with self._lock:
+                self._dirs[key] = entries
+        return entries
+
+    def prefetch(self, directories):
+        """Scan several folders in parallel, network shares answer slowly one by one."""
+        todo = []
+        with self._lock:
+            for d in directories:
+                key = os.path.normpath(str(d))
+                if key not in self._dirs and key not in todo:
+                    todo.append(key)
+        if not todo:
+            return
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for key, entries in zip(todo, pool.map(self._scan, todo)):
+                with self._lock:
+                    self._dirs[key] = entries
+
+    def invalidate(self, directory=None):
+        """Forget one folder, or everything, so it is scanned again."""
+        with self._lock:
+            if directory is None:
+                self._dirs.clear()
+            else:
+                self._dirs.pop(os.path.normpath(str(directory)), None)
+
+    def files_for_language(self, directory, lang=None) -> list:
+        """PDF files of a language: None = all, "" = untranslated, otherwise files ending in _<lang>.pdf."""
+        files = []
+        for name, entry in self.listing(directory).items():
+            if entry["is_dir"]:
+                continue
+            if lang is None:
+                match = fnmatch(name, "*.pdf")
+            elif lang == "":
+                match = fnmatch(name, "*.pdf") and not LANG_SUFFIX.search(name)
+            else:
+                match = fnmatch(name, f"*_{lang}.pdf")
+            if match:
+                files.append(entry)
+        return files
+
+    def numbered(self, directory, lang=None) -> dict:
+        """PDF files of a language keyed by the first number in their name."""
+        files = {}
+        for entry in self.files_for_language(directory, lang):
+            match = NUMBER.search(entry["file"].stem)
+            if match:
+                files[int(match.group())] = entry
+        return files
+
+
+directory_index = DirectoryIndex()
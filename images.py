@@ -0,0 +1,199 @@
+import hashlib
+import io
+import math
+import threading
+import zlib
+from pathlib import Path
+from pypdf import PdfWriter
+from atomicfile import write_atomic
+from pypdf.generic import ContentStream, DecodedStreamObject, DictionaryObject, IndirectObject, NameObject, NumberObject
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+#############################################################################
+# Kuvien pienennys: tehollinen DPI-raja ja JPEG-laatu
+#############################################################################
+
+IDENTITY = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+COLOURSPACES = {"/DeviceRGB": "RGB", "/DeviceGray": "L"}
+
+def _multiply(m, n) -> tuple:
+    """Matrix product m x n of two PDF matrices [a b c d e f]."""
+    return (m[0] * n[0] + m[1] * n[2], m[0] * n[1] + m[1] * n[3],
+            m[2] * n[0] + m[3] * n[2], m[2] * n[1] + m[3] * n[3],
+            m[4] * n[0] + m[5] * n[2] + n[4], m[4] * n[1] + m[5] * n[3] + n[5])
+
+def image_placements(writer: PdfWriter) -> dict:
+    """Largest displayed size in points and the reference of every image XObject, keyed by object number.
+
+    The content streams of the pages and the form XObjects they draw are
+    walked with the current transformation matrix, an image is drawn in the
+    unit square so its size on the page is the length of the matrix axes.
+    """
+    sizes = {}
+
+    def walk(stream, resources, ctm, forms):
+        xobjects = resources.get("/XObject") if resources is not None else None
+        xobjects = xobjects.get_object() if xobjects is not None else DictionaryObject()
+        stack = []
+        for operands, operator in ContentStream(stream, writer).operations:
+            if operator == b"q":
+                stack.append(ctm)
+            elif operator == b"Q" and stack:
+                ctm = stack.pop()
+            elif operator == b"cm" and len(operands) == 6:
+                ctm = _multiply(tuple(float(x) for x in operands), ctm)
+            elif operator == b"Do" and operands and operands[0] in xobjects:
+                ref = xobjects.raw_get(operands[0])
+                if not isinstance(ref, IndirectObject) or ref.idnum in forms:
+                    continue
+                xobj = ref.get_object()
+                if xobj.get("/Subtype") == "/Image":
+                    w, h = math.hypot(ctm[0], ctm[1]), math.hypot(ctm[2], ctm[3])
+                    old = sizes.get(ref.idnum, (0.0, 0.0, ref))
+                    sizes[ref.idnum] = (max(old[0], w), max(old[1], h), ref)
+                elif xobj.get("/Subtype") == "/Form":
+                    matrix = tuple(float(x) for x in xobj.get("/Matrix", IDENTITY))
+                    form_resources = xobj.get("/Resources")
+                    walk(xobj, form_resources.get_object() if form_resources is not None else resources,
+                         _multiply(matrix, ctm), forms | {ref.idnum})
+
+    for page in writer.pages:
+        contents = page.get_contents()
+        if contents is None:
+            continue
+        resources = page.get("/Resources")
+        walk(contents, resources.get_object() if resources is not None else None, IDENTITY, frozenset())
+    return sizes
+
+def _decode(xobj):
+    """The image as a PIL image and whether it was a JPEG, None if it is a kind we leave alone."""
+    if xobj.get("/ImageMask") or "/Mask" in xobj or "/Decode" in xobj:
+        return None, False
+    filters = xobj.get("/Filter")
+    filters = [filters] if isinstance(filters, str) else list(filters or [])
+    # ASCII wrappers are undone by get_data(), only the real compression matters
+    filters = [f for f in filters if f not in ("/ASCII85Decode", "/ASCIIHexDecode")]
+    colourspace = xobj.get("/ColorSpace")
+    if isinstance(colourspace, IndirectObject):
+        colourspace = colourspace.get_object()
+    if isinstance(colourspace, list) and colourspace and colourspace[0] == "/ICCBased":
+        colourspace = {1: "/DeviceGray", 3: "/DeviceRGB"}.get(colourspace[1].get_object().get("/N"))
+    if filters == ["/DCTDecode"]:
+        img = Image.open(io.BytesIO(xobj.get_data()))
+        if img.mode not in ("RGB", "L"):
+            return None, False
+        return img, True
+    if filters in ([], ["/FlateDecode"]) and xobj.get("/BitsPerComponent") == 8 and colourspace in COLOURSPACES:
+        size = (int(xobj["/Width"]), int(xobj["/Height"]))
+        return Image.frombytes(COLOURSPACES[colourspace], size, xobj.get_data()), False
+    return None, False
+
+def _encode(img, jpeg: bool, quality: int) -> bytes:
+    """Photos are stored as JPEG, other images losslessly so diagrams and screenshots stay sharp."""
+    if jpeg:
+        data = io.BytesIO()
+        img.save(data, "JPEG", quality=quality, optimize=True)
+        return data.getvalue()
+    return zlib.compress(img.tobytes(), 9)
+
+class ImageCache:
+    """Recompressed images keyed by the hash of the original and the target size.
+
+    Kept in memory for the run and on disk, so an image shared by several
+    lectures, languages or worker processes is recompressed only once. An
+    empty file means that recompressing did not make the image smaller.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                return self._memory[key]
+        path = self.cache_dir / key
+        if not path.exists():
+            return None
+        data = path.read_bytes()
+        with self._lock:
+            self._memory[key] = data
+        return data
+
+    def put(self, key, data: bytes):
+        with self._lock:
+            self._memory[key] = data
+        write_atomic(self.cache_dir / key, data)
+
+_caches = {}
+
+def get_image_cache(cache_dir) -> ImageCache:
+    """The image cache of this process for cache_dir."""
+    if cache_dir not in _caches:
+        _caches[cache_dir] = ImageCache(cache_dir)
+    return _caches[cache_dir]
+
+def image_settings(config) -> dict:
+    """Image recompression settings of a run, None if it is disabled or Pillow is not installed."""
+    max_dpi = int(config["settings"]["image_max_dpi"])
+    if not max_dpi or Image is None:
+        return None
+    return {"max_dpi": max_dpi,
+            "quality": int(config["settings"]["image_jpeg_quality"]),
+            "min_bytes": int(config["settings"]["image_min_kb"]) * 1024}
+
+def downsample_images(writer: PdfWriter, cache: ImageCache, max_dpi: int, quality: int, min_bytes: int) -> tuple:
+    """Downsample the images of writer that exceed max_dpi where they are displayed.
+
+    Images smaller than min_bytes or already within max_dpi are skipped, as
+    are masks and images whose colours we would not reproduce faithfully.
+    An image is replaced only if the result is smaller.
+    Returns (bytes before, bytes after) of the replaced images.
+    """
+    before = after = 0
+    for width_pt, height_pt, ref in image_placements(writer).values():
+        xobj = ref.get_object()
+        original = xobj._data
+        if len(original) < min_bytes or not width_pt or not height_pt:
+            continue
+        width, height = int(xobj["/Width"]), int(xobj["/Height"])
+        scale = max(width_pt / 72 * max_dpi / width, height_pt / 72 * max_dpi / height)
+        if scale >= 1:
+            continue
+        target = (max(1, round(width * scale)), max(1, round(height * scale)))
+        key = hashlib.sha256(original + repr((target, quality)).encode()).hexdigest()
+        data = cache.get(key)
+        if data is None:
+            img, jpeg = _decode(xobj)
+            if img is None:
+                cache.put(key, b"")
+                continue
+            # Two header bytes tell the encoding and colour space of the cached image
+            data = bytes([jpeg, img.mode == "RGB"]) + _encode(img.resize(target, Image.LANCZOS), jpeg, quality)
+            if len(data) - 2 >= len(original):
+                data = b""
+            cache.put(key, data)
+        if not data:
+            continue
+        jpeg, rgb = data[0], data[1]
+        image = DecodedStreamObject()
+        image.set_data(data[2:])
+        image[NameObject("/Type")] = NameObject("/XObject")
+        image[NameObject("/Subtype")] = NameObject("/Image")
+        image[NameObject("/Width")] = NumberObject(target[0])
+        image[NameObject("/Height")] = NumberObject(target[1])
+        image[NameObject("/ColorSpace")] = NameObject("/DeviceRGB" if rgb else "/DeviceGray")
+        image[NameObject("/BitsPerComponent")] = NumberObject(8)
+        image[NameObject("/Filter")] = NameObject("/DCTDecode" if jpeg else "/FlateDecode")
+        for name in ("/SMask", "/Interpolate", "/Intent"):
+            if name in xobj:
+                image[NameObject(name)] = xobj[name]
+        # Every resource dictionary refers to the image by object number, replacing the object updates them all
+        writer._replace_object(ref, image)
+        before += len(original)
+        after += len(data) - 2
+    return before, after
@@ -0,0 +1,275 @@
+import argparse
+import http.server
+import random
+import shutil
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from reportlab.pdfgen import canvas
+
+#############################################################################
+# Linkkitarkistuksen mittaus paikallisella testipalvelimella
+#############################################################################
+
+PAGE_SIZE = (960, 540)
+BODY_CHUNK = b"x" * 65536
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """Answers according to the path, so a URL alone decides what the checker sees.
+
+    /status/<code>            the status code at once
+    /delay/<ms>/<code>        the status code after ms milliseconds
+    /redirect/<n>/<code>      n redirects, then the status code
+    /hang/<ms>                nothing for ms milliseconds, longer than the client timeout
+    /big/<kb>/<code>          the status code with a body of kb kilobytes
+    /nohead/<code>            405 to HEAD, the status code to GET
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, code, length=0):
+        self.send_response(code)
+        self.send_header("Content-Length", str(length))
+        self.end_headers()
+
+    def _handle(self, head):
+        time.sleep(self.server.delay)
+        parts = self.path.split("?")[0].strip("/").split("/")
+        kind, args = parts[0], [int(p) for p in parts[1:] if p.isdigit()]
+        if kind == "delay":
+            time.sleep(args[0] / 1000)
+            self._reply(args[1])
+        elif kind == "redirect" and args[0] > 0:
+            self.send_response(302)
+            self.send_header("Location", f"/redirect/{args[0] - 1}/{args[1]}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif kind == "redirect":
+            self._reply(args[1])
+        elif kind == "hang":
+            time.sleep(args[0] / 1000)
+            self.close_connection = True
+        elif kind == "big":
+            size = args[0] * 1024
+            self._reply(args[1], size)
+            if not head:
+                try:
+                    while size > 0:
+                        self.wfile.write(BODY_CHUNK[:size])
+                        size -= len(BODY_CHUNK)
+                except OSError:
+                    # The checker closes the connection after the headers
+                    self.close_connection = True
+        elif kind == "nohead" and head:
+            self._reply(405)
+        elif kind in ("nohead", "status"):
+            self._reply(args[0])
+        else:
+            self._reply(404)
+
+    def do_HEAD(self):
+        self._handle(True)
+
+    def do_GET(self):
+        self._handle(False)
+
+class StandInServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    # Added to every response, a slow host
+    delay = 0.0
+
+    def handle_error(self, request, client_address):
+        # Clients closing the connection early is expected, see /big and /hang
+        if not isinstance(sys.exc_info()[1], OSError):
+            super().handle_error(request, client_address)
+
+def start_servers(count: int, delay: float = 0.0) -> list:
+    """Start count stand-in servers on free ports of 127.0.0.1, returns their base URLs.
+
+    The link checker tells hosts apart by host and port, so every server
+    counts as its own host for the per-host limit. delay seconds are added
+    to every response.
+    """
+    urls = []
+    for _ in range(count):
+        server = StandInServer(("127.0.0.1", 0), StandInHandler)
+        server.delay = delay
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        urls.append(f"http://127.0.0.1:{server.server_address[1]}")
+    return urls
+
+def expected_state(path: str) -> str:
+    """The state ("dead", "alive" or "") test_link should give a stand-in URL path."""
+    parts = path.strip("/").split("/")
+    if parts[0] == "hang":
+        return "dead"
+    code = int(parts[-1])
+    if code >= 500 or code == 404:
+        return "dead"
+    return "" if code >= 400 else "alive"
+
+def generate_paths(count: int, rnd: random.Random, max_delay: int, hang_ms: int) -> list:
+    """count URL paths with a mix of behaviours, roughly what a real course links to."""
+    kinds = [("status", 50), ("delay", 20), ("redirect", 8), ("big", 5), ("nohead", 5), ("hang", 2), ("error", 10)]
+    names = [k for k, _ in kinds]
+    weights = [w for _, w in kinds]
+    paths = []
+    for _ in range(count):
+        kind = rnd.choices(names, weights)[0]
+        if kind == "status":
+            paths.append("/status/200")
+        elif kind == "delay":
+            paths.append(f"/delay/{rnd.randint(0, max_delay)}/200")
+        elif kind == "redirect":
+            paths.append(f"/redirect/{rnd.randint(1, 3)}/{rnd.choice([200, 200, 404])}")
+        elif kind == "big":
+            paths.append(f"/big/{rnd.choice([512, 4096])}/{rnd.choice([200, 404])}")
+        elif kind == "nohead":
+            paths.append(f"/nohead/{rnd.choice([200, 410])}")
+        elif kind == "hang":
+            paths.append(f"/hang/{hang_ms}")
+        else:
+            paths.append(f"/status/{rnd.choice([403, 404, 500, 503])}")
+    return paths
+
+def make_link_pdf(path: Path, urls: list, per_page: int):
+    """Write a PDF with per_page link annotations on every page."""
+    c = canvas.Canvas(str(path), PAGE_SIZE)
+    for start in range(0, len(urls), per_page):
+        c.setFont("Helvetica", 10)
+        for i, url in enumerate(urls[start:start + per_page]):
+            y = 20 + (i % 50) * 10
+            x = 20 + (i // 50) * 180
+            c.drawString(x, y, url[-28:])
+            c.linkURL(url, (x, y, x + 170, y + 9), relative=0)
+        c.showPage()
+    c.save()
+
+def generate_pdfs(root: Path, servers: list, down: list, links: int, files: int, per_page: int, duplicates: float,
+                  seed: int, max_delay: int, hang_ms: int) -> dict:
+    """Write files PDFs with links link annotations in total, returns {url: expected state}.
+
+    A share of duplicates of the links point at URLs that were already used,
+    as lectures and their translations do. Links to the down hosts are dead
+    whatever their path.
+    """
+    rnd = random.Random(seed)
+    unique = max(1, int(links * (1 - duplicates)))
+    paths = generate_paths(unique, rnd, max_delay, hang_ms)
+    # A query string keeps otherwise equal paths distinct URLs
+    urls = [f"{rnd.choice(servers + down)}{p}?n={i}" for i, p in enumerate(paths)]
+    every = urls + [rnd.choice(urls) for _ in range(links - unique)]
+    rnd.shuffle(every)
+    size = -(-len(every) // files)
+    for n in range(files):
+        make_link_pdf(root / f"links{n:03}.pdf", every[n * size:(n + 1) * size], per_page)
+    expected = {}
+    for url in urls:
+        scheme, _, host, path = url.split("/", 3)
+        expected[url] = "dead" if f"{scheme}//{host}" in down else expected_state(path.split("?")[0])
+    return expected
+
+def run_check(files: list, workers: int, per_host: int, timeout: float, timeout_max: float, breaker: int,
+              extract_workers: int):
+    """Extract and check the links of files the way --linkcheck does, returns (dead, alive, seconds, checker)."""
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    from utils import extract_links, test_link
+    from linkcheck import link_checker
+    link_checker.workers = workers
+    link_checker.per_host = per_host
+    link_checker.timeout = timeout
+    link_checker.timeout_max = timeout_max
+    link_checker.breaker = breaker
+    link_checker.cache = None
+    start = time.perf_counter()
+    dead, alive = test_link(link for file, found in extract_links(files, extract_workers) for link in found)
+    seconds = time.perf_counter() - start
+    link_checker.close()
+    return dead, alive, seconds, link_checker
+
+def verify(expected: dict, dead: list, alive: list) -> list:
+    """URLs whose state differs from the expected one, as (url, expected, got).
+
+    A URL missing from both lists was left out as a client error ("").
+    """
+    states = {}
+    for state, items in (("dead", dead), ("alive", alive)):
+        for item in items:
+            states.setdefault(item["url"], set()).add(state)
+    wrong = []
+    for url, want in expected.items():
+        got = states.get(url, {""})
+        if got != {want}:
+            wrong.append((url, want, "/".join(sorted(got))))
+    return wrong
+
+#############################################################################
+# MAIN
+#############################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Link checker throughput and correctness against local stand-in servers")
+    parser.add_argument("--links", type=int, default=3000, help="Link annotations in total")
+    parser.add_argument("--files", type=int, default=8, help="Number of PDFs")
+    parser.add_argument("--per-page", type=int, default=40, help="Link annotations per page")
+    parser.add_argument("--duplicates", type=float, default=0.3, help="Share of links to an already used URL")
+    parser.add_argument("--hosts", type=int, default=8, help="Number of stand-in servers (hosts)")
+    parser.add_argument("--slow-hosts", type=int, default=1, help="Stand-in servers that answer slower than --timeout")
+    parser.add_argument("--down-hosts", type=int, default=1, help="Stand-in servers that accept connections but never answer")
+    parser.add_argument("--max-delay", type=int, default=100, help="Largest response delay in ms")
+    parser.add_argument("--workers", type=int, default=16, help="linkcheck_workers")
+    parser.add_argument("--per-host", type=int, default=4, help="linkcheck_per_host")
+    parser.add_argument("--timeout", type=float, default=0.5, help="linkcheck_timeout in seconds")
+    parser.add_argument("--timeout-max", type=float, default=3.0, help="linkcheck_timeout_max in seconds")
+    parser.add_argument("--breaker", type=int, default=5, help="linkcheck_breaker_failures")
+    parser.add_argument("--extract-workers", type=int, default=4, help="linkextract_workers")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the generated links")
+    parser.add_argument("--workdir", type=str, help="Where to write the PDFs (default: temporary folder)")
+    parser.add_argument("--serve", action="store_true", help="Only run the stand-in servers until interrupted")
+    args = parser.parse_args()
+
+    servers = start_servers(args.hosts) + start_servers(args.slow_hosts, args.timeout * 1.5)
+    if args.serve:
+        print("Testipalvelimet:")
+        for url in servers:
+            print(f"  {url}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            sys.exit(0)
+
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix="pdfpublisher-linkbench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    hang_ms = int(args.timeout_max * 1000) + 1000
+    down = start_servers(args.down_hosts, 3600)
+    expected = generate_pdfs(workdir, servers, down, args.links, args.files, args.per_page, args.duplicates,
+                             args.seed, args.max_delay, hang_ms)
+    files = [str(f) for f in sorted(workdir.glob("links*.pdf"))]
+    print(f"Generoitu {args.links} linkkiä ({len(expected)} eri osoitetta) {len(files)} tiedostoon, {len(servers)} palvelinta ({args.slow_hosts} hidasta), {len(down)} alhaalla -> {workdir}")
+
+    dead, alive, seconds, checker = run_check(files, args.workers, args.per_host, args.timeout, args.timeout_max,
+                                              args.breaker, args.extract_workers)
+    wrong = verify(expected, dead, alive)
+    ignored = args.links - len(dead) - len(alive)
+    print(f"{'aika_s':>16}: {seconds:8.3f}")
+    print(f"{'linkkiä_s':>16}: {args.links / seconds:8.1f}")
+    print(f"{'osoitetta_s':>16}: {len(expected) / seconds:8.1f}")
+    print(f"Rikki {len(dead)}, toimii {len(alive)}, ohitettu {ignored}")
+    print(checker.stats())
+    for url, want, got in wrong[:20]:
+        print(f"  VÄÄRIN {url}: odotettu '{want}', saatiin '{got}'")
+    if wrong:
+        print(f"{len(wrong)} linkkiä luokiteltiin väärin")
+    else:
+        print("Kaikki linkit luokiteltiin oikein")
+
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(1 if wrong else 0)
@@ -0,0 +1,328 @@
+import json
+import threading
+import time
+import requests
+import requests.adapters
+from pathlib import Path
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlsplit
+from atomicfile import write_atomic
+
+#############################################################################
+# Rinnakkainen linkkien tarkistus: yhteinen ja palvelinkohtainen raja
+#############################################################################
+
+USER_AGENT = {'User-Agent': 'Mozilla/5.0'}
+# A host's read timeout is this many times its smoothed response time
+LATENCY_FACTOR = 4
+# Weight of the newest response time in the smoothed value
+LATENCY_SMOOTHING = 0.3
+
+def host_of(url: str) -> str:
+    try:
+        return urlsplit(url).netloc.lower()
+    except ValueError:
+        return ""
+
+def classify(item: dict, status) -> str:
+    """Sort a checked link into "dead", "alive" or "" (client errors other than 404 are ignored).
+
+    status is the HTTP status code or "timeout" when the request failed.
+    """
+    if status == "timeout" or status >= 500 or status == 404:
+        item.update({"error_code": status})
+        return "dead"
+    if status >= 400:
+        item.update({"error_code": status})
+        return ""
+    return "alive"
+
+class HostScheduler:
+    """Runs probes in a thread pool, at most `workers` at a time and `per_host` per host.
+
+    URLs wait in per-host queues instead of holding a pool thread, so a long
+    queue for one slow host never keeps the other hosts waiting.
+    """
+    def __init__(self, pool, workers: int, per_host: int, probe):
+        self.pool = pool
+        self.workers = workers
+        self.per_host = per_host
+        self.probe = probe
+        self._queues = OrderedDict()
+        self._running = defaultdict(int)
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def submit(self, url) -> Future:
+        future = Future()
+        with self._lock:
+            self._queues.setdefault(host_of(url), deque()).append((url, future))
+            self._dispatch()
+        return future
+
+    def _dispatch(self):
+        # Called with the lock held
+        for host in list(self._queues):
+            queue = self._queues[host]
+            while queue and self._running[host] < self.per_host and self._active < self.workers:
+                url, future = queue.popleft()
+                self._running[host] += 1
+                self._active += 1
+                self.pool.submit(self._run, host, url, future)
+            if not queue:
+                del self._queues[host]
+            if self._active >= self.workers:
+                return
+
+    def _run(self, host, url, future):
+        try:
+            future.set_result(self.probe(url))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._running[host] -= 1
+                self._active -= 1
+                self._dispatch()
+
+class HostHealth:
+    """What one run has seen of a host: consecutive failures and smoothed response time."""
+    def __init__(self):
+        self.failures = 0
+        self.latency = None
+        self.open = False
+
+    def record(self, status, seconds, breaker: int) -> bool:
+        """Record a probe result, returns True if this opened the breaker."""
+        if status == "timeout":
+            self.failures += 1
+            if breaker and not self.open and self.failures >= breaker:
+                self.open = True
+                return True
+            return False
+        self.failures = 0
+        self.latency = seconds if self.latency is None else \
+            LATENCY_SMOOTHING * seconds + (1 - LATENCY_SMOOTHING) * self.latency
+        return False
+
+class LinkCache:
+    """Last status of every checked URL with the time it was checked.
+
+    A result is reused while it is younger than its TTL: ttl_ok seconds
+    for a working link and the shorter ttl_fail for anything else, so broken
+    links are retried soon while healthy ones are left alone for a while.
+    """
+    def __init__(self, path, ttl_ok: float, ttl_fail: float):
+        self.path = Path(path)
+        self.ttl_ok = ttl_ok
+        self.ttl_fail = ttl_fail
+        self.results = {}
+        self._lock = threading.Lock()
+        if self.path.exists():
+            try:
+                self.results = json.loads(self.path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                print(f"[WARNING] Link cache {self.path} could not be read, checking every link")
+
+    def get(self, url):
+        """Cached (status, response time in ms) of url, None if it has to be checked."""
+        with self._lock:
+            entry = self.results.get(url)
+        if entry is None:
+            return None
+        status = entry["status"]
+        ttl = self.ttl_ok if status != "timeout" and status < 400 else self.ttl_fail
+        if time.time() - entry["checked"] > ttl:
+            return None
+        return status, entry.get("ms")
+
+    def put(self, url, status, ms):
+        with self._lock:
+            self.results[url] = {"status": status, "ms": ms, "checked": time.time()}
+
+    def save(self):
+        """Write the cache atomically, expired entries are dropped."""
+        now = time.time()
+        ttl = max(self.ttl_ok, self.ttl_fail)
+        with self._lock:
+            data = {url: entry for url, entry in self.results.items() if now - entry["checked"] <= ttl}
+            text = json.dumps(data, ensure_ascii=False)
+        write_atomic(self.path, text)
+
+class LinkChecker:
+    """Checks the links of any number of files concurrently.
+
+    At most `workers` requests are in flight in total and at most `per_host`
+    to any one host, so a deck full of links to one slow site neither hogs
+    the pool nor hammers that site.
+
+    After `breaker` failed requests in a row to a host its remaining links
+    are marked dead without requesting them (0 = never). The read timeout of
+    a host follows its observed response time between `timeout` and
+    `timeout_max`.
+    """
+    def __init__(self, workers: int = 16, per_host: int = 4, timeout: float = 5.0, cache: LinkCache = None,
+                 breaker: int = 5, timeout_max: float = 30.0):
+        self.workers = workers
+        self.per_host = per_host
+        self.timeout = timeout
+        self.timeout_max = timeout_max
+        self.breaker = breaker
+        self.cache = cache
+        self.probed = 0
+        self.cached = 0
+        self.inferred = 0
+        self.tripped = []
+        self._statuses = {}
+        self._sessions = {}
+        self._hosts = defaultdict(HostHealth)
+        self._lock = threading.Lock()
+
+    def _session(self, host) -> requests.Session:
+        """One pooled session per host, its connections are kept alive between requests."""
+        with self._lock:
+            if host not in self._sessions:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.per_host)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update(USER_AGENT)
+                self._sessions[host] = session
+            return self._sessions[host]
+
+    def read_timeout(self, health: HostHealth) -> float:
+        """Read timeout for a host, `timeout` until it has answered, then scaled to its response time."""
+        if health.latency is None:
+            return self.timeout
+        return min(self.timeout_max, max(self.timeout, LATENCY_FACTOR * health.latency))
+
+    def _request(self, session, url, timeout):
+        resp = session.head(url, allow_redirects=True, timeout=timeout)
+        status = resp.status_code
+        if status >= 400:
+            with session.get(url, allow_redirects=True, timeout=timeout, stream=True) as resp:
+                status = resp.status_code
+        return status
+
+    def probe(self, url):
+        """(HTTP status, response time in ms, inferred) of url, the status is "timeout" if it could not be fetched.
+
+        A HEAD request is tried first. Many servers reject or mishandle HEAD,
+        so an error is confirmed with a GET that is closed as soon as the
+        headers have arrived, the body is never downloaded.
+
+        If the host's breaker is open no request is made and the result is
+        inferred. A host that accepts the connection but has not answered
+        yet in this run gets one more try with `timeout_max`, so a slow
+        site is not taken for a dead one before its speed is known.
+        """
+        host = host_of(url)
+        with self._lock:
+            health = self._hosts[host]
+            if health.open:
+                self.inferred += 1
+                return "timeout", None, True
+            read_timeout = self.read_timeout(health)
+        session = self._session(host)
+        start = time.perf_counter()
+        try:
+            try:
+                status = self._request(session, url, (self.timeout, read_timeout))
+            except requests.ReadTimeout:
+                if health.latency is not None or read_timeout >= self.timeout_max:
+                    raise
+                status = self._request(session, url, (self.timeout, self.timeout_max))
+        except requests.RequestException:
+            status = "timeout"
+        seconds = time.perf_counter() - start
+        with self._lock:
+            if health.record(status, seconds, self.breaker):
+                self.tripped.append(host)
+        return status, round(seconds * 1000), False
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+    def _status(self, url, scheduler) -> Future:
+        """Status of url: fetched once per run, from the cache while it is fresh."""
+        if url in self._statuses:
+            return self._statuses[url]
+        result = self.cache.get(url) if self.cache is not None else None
+        if result is not None:
+            future = Future()
+            future.set_result((*result, False))
+            self.cached += 1
+        else:
+            future = scheduler.submit(url)
+            self.probed += 1
+            if self.cache is not None:
+                def store(done):
+                    if done.exception() is None:
+                        status, ms, inferred = done.result()
+                        # An inferred result is not a check, the URL is requested next time
+                        if not inferred:
+                            self.cache.put(url, status, ms)
+                future.add_done_callback(store)
+        self._statuses[url] = future
+        return future
+
+    def check(self, links):
+        """Check an iterable of link dicts, returns (dead, alive) in input order.
+
+        Links are submitted as they are read from the iterable, so a generator
+        that is still extracting links keeps the pool busy. Every URL is
+        requested at most once per run however many files and pages link to
+        it, and not at all while its cached result is fresh. item["inferred"]
+        tells whether a link was marked dead without requesting it, because
+        its host had stopped answering.
+        """
+        seen = set()
+        pending = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="linkcheck") as pool:
+            scheduler = HostScheduler(pool, self.workers, self.per_host, self.probe)
+            for item in links:
+                if not isinstance(item, dict):
+                    continue
+                url = item.get("url")
+                if not url:
+                    continue
+                key = (url, item.get("file"), item.get("page_number"))
+                if key in seen:
+                    continue
+                seen.add(key)
+                pending.append((item, self._status(url, scheduler)))
+            dead, alive = [], []
+            for item, future in pending:
+                status, ms, inferred = future.result()
+                item["response_ms"] = ms
+                item["inferred"] = inferred
+                state = classify(item, status)
+                if state == "dead":
+                    dead.append(item)
+                elif state == "alive":
+                    alive.append(item)
+        if self.cache is not None:
+            self.cache.save()
+        return dead, alive
+
+    def stats(self) -> str:
+        text = f"Linkkejä haettu {self.probed - self.inferred}, välimuistista {self.cached}"
+        if self.tripped:
+            text += f", {self.inferred} päätelty ({len(self.tripped)} palvelinta ei vastannut: {', '.join(self.tripped)})"
+        return text
+
+link_checker = LinkChecker()
+
+def configure_link_checker(config):
+    link_checker.workers = int(config["settings"]["linkcheck_workers"])
+    link_checker.per_host = int(config["settings"]["linkcheck_per_host"])
+    link_checker.timeout = float(config["settings"]["linkcheck_timeout"])
+    link_checker.timeout_max = float(config["settings"]["linkcheck_timeout_max"])
+    link_checker.breaker = int(config["settings"]["linkcheck_breaker_failures"])
+    link_checker.cache = LinkCache(Path(config["settings"]["cache_dir"]) / "link_cache.json",
+                                   ttl_ok=float(config["settings"]["linkcheck_ttl_ok_hours"]) * 3600,
+                                   ttl_fail=float(config["settings"]["linkcheck_ttl_fail_hours"]) * 3600)
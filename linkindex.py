@@ -0,0 +1,121 @@
+import json
+import threading
+import time
+from pathlib import Path
+from atomicfile import write_atomic
+from manifest import sha256_file
+from utils import find_links, extract_links
+
+#############################################################################
+# Linkki-indeksi: tiedostoista poimitut linkit sisältötiivisteen mukaan
+#############################################################################
+
+LINK_INDEX_FILE = "link_index.json"
+# Entries of files not seen for this long are dropped
+STALE_SECONDS = 90 * 24 * 3600
+
+def hash_and_find_links(file):
+    """(content hash, link dicts) of file, run in the extraction workers."""
+    return sha256_file(file), find_links(file)
+
+class LinkIndex:
+    """Links extracted from PDF files, keyed by the content hash of the file.
+
+    File hashes are cached by (size, mtime) in the index itself, and the
+    hashes the build manifest recorded when the files were published are
+    used as they are, so on a stable term finding the links of every
+    published file costs one stat per file and no PDF is parsed. The
+    manifest is only read, publishing owns it.
+    """
+    def __init__(self, path, manifest=None):
+        self.path = Path(path)
+        self.manifest = manifest
+        self.entries = {}
+        self.hashes = {}
+        self.parsed = 0
+        self.indexed = 0
+        self._lock = threading.Lock()
+        if self.path.exists():
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    data = json.load(f)
+                if "links" in data and "hashes" in data:
+                    self.entries, self.hashes = data["links"], data["hashes"]
+                else:
+                    # Written before the index had hashes of its own
+                    self.entries = data
+            except (OSError, ValueError) as e:
+                print(f"[WARNING] Could not read link index {self.path}: {e}")
+
+    def known_hash(self, file, st):
+        """Cached content hash of file if its size and mtime are unchanged, from the index or the manifest."""
+        with self._lock:
+            cached = self.hashes.get(str(file))
+        if cached and cached["size"] == st.st_size and cached["mtime"] == st.st_mtime_ns:
+            return cached["sha256"]
+        return self.manifest.known_hash(file, st) if self.manifest is not None else None
+
+    def _lookup(self, file, st):
+        """Indexed link dicts of file, None if its content is not known without reading it."""
+        sha = self.known_hash(file, st)
+        with self._lock:
+            entry = self.entries.get(sha) if sha is not None else None
+            if entry is None:
+                return None
+            self.hashes[str(file)] = {"size": st.st_size, "mtime": st.st_mtime_ns, "sha256": sha}
+            entry["used"] = time.time()
+            self.indexed += 1
+        return self._expand(file, entry)
+
+    def _store(self, file, st, sha, found):
+        entry = {"links": [[link["url"], link["page_number"]] for link in found], "used": time.time()}
+        with self._lock:
+            self.hashes[str(file)] = {"size": st.st_size, "mtime": st.st_mtime_ns, "sha256": sha}
+            if sha in self.entries:
+                self.indexed += 1
+            else:
+                self.parsed += 1
+            self.entries[sha] = entry
+        return self._expand(file, entry)
+
+    @staticmethod
+    def _expand(file, entry) -> list:
+        return [{"url": url, "file": file, "page_number": page, "error_code": None} for url, page in entry["links"]]
+
+    def iter_links(self, files, workers: int):
+        """Yield the link dicts of files, hashing and parsing the others in `workers` processes.
+
+        Files whose hash is known without reading them are yielded first. The
+        rest are read only by the workers, which hash and parse each file in
+        one go, and are yielded as soon as a worker has read them, so
+        checking starts while extraction is still running.
+        """
+        missing = {}
+        for file in files:
+            try:
+                st = Path(file).stat()
+            except OSError as e:
+                print(f"[WARNING] Could not read links of {file}: {e}")
+                continue
+            found = self._lookup(file, st)
+            if found is None:
+                missing[file] = st
+            else:
+                yield from found
+        for file, (sha, found) in extract_links(missing, workers, hash_and_find_links):
+            yield from self._store(file, missing[file], sha, found)
+
+    def stats(self) -> str:
+        return f"Linkit luettu {self.parsed} tiedostosta, {self.indexed} indeksistä"
+
+    def save(self):
+        """Write the index atomically, entries unused for STALE_SECONDS and the hashes of their files are dropped."""
+        now = time.time()
+        with self._lock:
+            links = {sha: entry for sha, entry in self.entries.items() if now - entry["used"] <= STALE_SECONDS}
+            hashes = {path: h for path, h in self.hashes.items() if h["sha256"] in links}
+            text = json.dumps({"links": links, "hashes": hashes}, ensure_ascii=False)
+        write_atomic(self.path, text)
+
+def load_link_index(config, manifest=None) -> LinkIndex:
+    return LinkIndex(Path(config["settings"]["cache_dir"]) / LINK_INDEX_FILE, manifest)
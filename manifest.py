@@ -0,0 +1,106 @@
+import hashlib
+import json
+import threading
+from pathlib import Path
+from atomicfile import write_atomic
+
+#############################################################################
+# Käännösmanifesti: sisältötiivisteet julkaisupäätöksiin
+#############################################################################
+
+MANIFEST_FILE = "build_manifest.json"
+
+def sha256_file(path, blocksize=1024*1024) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class BuildManifest:
+    """Persistent record of what every published output was built from.
+
+    For each output the manifest stores a digest over the content of every input
+    file, the title and font settings and the page order. File hashes are cached
+    by (size, mtime) so unchanged files are not read again. The material files
+    synced to each publication folder are listed so removed ones can be pruned.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.outputs = {}
+        self.hashes = {}
+        self.materials = {}
+        self._lock = threading.Lock()
+        if self.path.exists():
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    data = json.load(f)
+                self.outputs = data.get("outputs", {})
+                self.hashes = data.get("hashes", {})
+                self.materials = data.get("materials", {})
+            except (OSError, ValueError) as e:
+                print(f"[WARNING] Could not read build manifest {self.path}: {e}")
+
+    def known_hash(self, path, st=None):
+        """Cached content hash of a file if its size and mtime are unchanged, otherwise None."""
+        st = st or Path(path).stat()
+        with self._lock:
+            cached = self.hashes.get(str(path))
+        if cached and cached["size"] == st.st_size and cached["mtime"] == st.st_mtime_ns:
+            return cached["sha256"]
+        return None
+
+    def file_hash(self, path) -> str:
+        """Content hash of a file, re-read only when its size or mtime has changed."""
+        path = Path(path)
+        st = path.stat()
+        known = self.known_hash(path, st)
+        if known:
+            return known
+        digest = sha256_file(path)
+        with self._lock:
+            self.hashes[str(path)] = {"size": st.st_size, "mtime": st.st_mtime_ns, "sha256": digest}
+        return digest
+
+    def digest(self, input_hashes: dict, settings: dict) -> str:
+        """Digest over the input hashes in page order and the settings used for the output."""
+        h = hashlib.sha256()
+        h.update(json.dumps(settings, sort_keys=True, ensure_ascii=False).encode())
+        for sha in input_hashes.values():
+            h.update(b"\0")
+            h.update(sha.encode())
+        return h.hexdigest()
+
+    def get(self, output):
+        """Previous build record of output: {"digest": str, "inputs": {path: sha256}} or None."""
+        return self.outputs.get(str(output))
+
+    def record(self, output, digest, input_hashes: dict):
+        """Store the digest and per-input hashes an output was built from."""
+        with self._lock:
+            self.outputs[str(output)] = {"digest": digest, "inputs": dict(input_hashes)}
+
+    def seed_hash(self, path, sha256: str):
+        """Remember the hash of a file we just wrote, so it never has to be read back."""
+        path = Path(path)
+        st = path.stat()
+        with self._lock:
+            self.hashes[str(path)] = {"size": st.st_size, "mtime": st.st_mtime_ns, "sha256": sha256}
+
+    def synced_materials(self, dest_dir) -> set:
+        """Relative paths of the material files synced to dest_dir on the last run."""
+        return set(self.materials.get(str(dest_dir), []))
+
+    def record_materials(self, dest_dir, relpaths):
+        with self._lock:
+            self.materials[str(dest_dir)] = sorted(relpaths)
+
+    def save(self):
+        """Write the manifest atomically so an interrupted run never leaves it half written."""
+        with self._lock:
+            data = json.dumps({"outputs": self.outputs, "hashes": self.hashes, "materials": self.materials},
+                              ensure_ascii=False)
+        write_atomic(self.path, data)
+
+def load_manifest(config) -> BuildManifest:
+    return BuildManifest(Path(config["settings"]["cache_dir"]) / MANIFEST_FILE)
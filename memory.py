@@ -0,0 +1,87 @@
+import gc
+import os
+import sys
+from pypdf import PdfReader
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+#############################################################################
+# Muistin käyttö: prosessin muistihuippu ja muistibudjetin mukainen kokoaminen
+#############################################################################
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes, None if it cannot be read."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def reset_peak_rss() -> bool:
+    """Reset the peak RSS of this process so that the next peak_rss() covers only what follows.
+
+    Only possible on Linux, elsewhere peak_rss() stays the peak of the whole process.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def peak_rss() -> int:
+    """Peak resident set size in bytes since the last reset, None if it cannot be read."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+# RSS when the current lecture was started, the budget applies to the growth from it
+_budget_start = 0
+
+def start_budget():
+    """Start measuring check_budget() from the memory this process uses now.
+
+    Workers are reused between lectures, so what earlier lectures, the
+    reader cache and the interpreter itself hold is not counted.
+    """
+    global _budget_start
+    _budget_start = current_rss() or 0
+
+def check_budget(budget: int, name: str):
+    """Raise MemoryError if the process has grown more than budget bytes since start_budget() (0 = no budget)."""
+    if not budget:
+        return
+    rss = current_rss()
+    if rss is not None and rss - _budget_start > budget:
+        raise MemoryError(f"{(rss - _budget_start) / 1048576:.0f} MB more in use after '{name}' than at the start, "
+                          f"memory budget is {budget / 1048576:.0f} MB")
+
+def stream_pages(writer, path) -> int:
+    """Copy every page of path into writer without keeping the source in memory.
+
+    The file is read lazily from disk instead of being loaded whole, and
+    afterwards the reader and the writer's translation table pointing to it
+    are dropped, so only the objects copied into writer stay in memory.
+    Returns the number of pages copied.
+    """
+    with open(path, "rb") as f:
+        reader = PdfReader(f)
+        for page in reader.pages:
+            writer.add_page(page)
+        count = len(reader.pages)
+        writer.reset_translation(reader)
+    del reader
+    gc.collect()
+    return count
@@ -0,0 +1,137 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from atomicfile import write_atomic
+
+#############################################################################
+# Ajon mittarit: vaiheiden kesto, luetut ja kirjoitetut tavut, sivumäärät
+#############################################################################
+
+FIELDS = ("seconds", "bytes_read", "bytes_written", "pages", "count")
+
+def _empty() -> dict:
+    return {field: 0 for field in FIELDS}
+
+def unit_key(unit) -> str:
+    return f"{unit['pub']}/{unit['lang'] or 'fi'}/{unit['lecture']}"
+
+class Stage:
+    """Counters of one timed stage, the code inside the stage adds bytes and pages."""
+    def __init__(self):
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.pages = 0
+
+class Metrics:
+    """Collects per-stage and per-lecture measurements of a run.
+
+    When disabled the methods do nothing, so instrumented code does not need
+    to check whether --metrics was given.
+    """
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.started = time.time()
+        self.stages = {}
+        self.units = {}
+        self.peaks = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, unit: str = None, seconds: float = 0.0, bytes_read: int = 0, bytes_written: int = 0, pages: int = 0):
+        if not self.enabled:
+            return
+        values = {"seconds": seconds, "bytes_read": bytes_read, "bytes_written": bytes_written, "pages": pages, "count": 1}
+        with self._lock:
+            targets = [self.stages.setdefault(stage, _empty())]
+            if unit is not None:
+                targets.append(self.units.setdefault(unit, {}).setdefault(stage, _empty()))
+            for target in targets:
+                for field, value in values.items():
+                    target[field] += value
+
+    def peak(self, unit: str, rss: int):
+        """Record the peak memory use (bytes) while a lecture was assembled."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.peaks[unit] = max(self.peaks.get(unit, 0), rss)
+
+    @contextmanager
+    def stage(self, stage: str, unit: str = None):
+        counters = Stage()
+        start = time.perf_counter()
+        try:
+            yield counters
+        finally:
+            self.add(stage, unit, time.perf_counter() - start, counters.bytes_read, counters.bytes_written, counters.pages)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {"started": self.started,
+                    "seconds": time.time() - self.started,
+                    "stages": json.loads(json.dumps(self.stages)),
+                    "units": json.loads(json.dumps(self.units)),
+                    "peak_rss": dict(self.peaks)}
+
+    def merge(self, other: dict):
+        """Add the measurements of a worker process."""
+        if not self.enabled or not other:
+            return
+        with self._lock:
+            for stage, values in other["stages"].items():
+                target = self.stages.setdefault(stage, _empty())
+                for field in FIELDS:
+                    target[field] += values[field]
+            for unit, stages in other["units"].items():
+                for stage, values in stages.items():
+                    target = self.units.setdefault(unit, {}).setdefault(stage, _empty())
+                    for field in FIELDS:
+                        target[field] += values[field]
+            for unit, rss in other.get("peak_rss", {}).items():
+                self.peaks[unit] = max(self.peaks.get(unit, 0), rss)
+
+    def write_json(self, path):
+        write_atomic(path, json.dumps(self.to_dict(), ensure_ascii=False, indent=2))
+
+    def write_prometheus(self, path):
+        """Write a node exporter textfile collector file."""
+        data = self.to_dict()
+        lines = ["# HELP pdfpublisher_run_seconds Wall time of the last publish run.",
+                 "# TYPE pdfpublisher_run_seconds gauge",
+                 f"pdfpublisher_run_seconds {data['seconds']:.3f}",
+                 "# HELP pdfpublisher_last_run_timestamp_seconds Start time of the last publish run.",
+                 "# TYPE pdfpublisher_last_run_timestamp_seconds gauge",
+                 f"pdfpublisher_last_run_timestamp_seconds {data['started']:.0f}"]
+        for field in FIELDS:
+            name = f"pdfpublisher_stage_{field}" if field != "count" else "pdfpublisher_stage_calls"
+            lines.append(f"# HELP {name} {field.replace('_', ' ').capitalize()} per stage in the last publish run.")
+            lines.append(f"# TYPE {name} gauge")
+            for stage, values in sorted(data["stages"].items()):
+                lines.append(f'{name}{{stage="{_label(stage)}"}} {_value(field, values[field])}')
+        for field in ("seconds", "bytes_read", "bytes_written", "pages"):
+            name = f"pdfpublisher_lecture_{field}"
+            lines.append(f"# HELP {name} {field.replace('_', ' ').capitalize()} per lecture and stage in the last publish run.")
+            lines.append(f"# TYPE {name} gauge")
+            for unit, stages in sorted(data["units"].items()):
+                pub, lang, lecture = unit.rsplit("/", 2)
+                for stage, values in sorted(stages.items()):
+                    lines.append(f'{name}{{publication="{_label(pub)}",language="{_label(lang)}",lecture="{lecture}",stage="{_label(stage)}"}} {_value(field, values[field])}')
+        lines.append("# HELP pdfpublisher_lecture_peak_rss_bytes Peak resident memory of the process while the lecture was assembled.")
+        lines.append("# TYPE pdfpublisher_lecture_peak_rss_bytes gauge")
+        for unit, rss in sorted(data["peak_rss"].items()):
+            pub, lang, lecture = unit.rsplit("/", 2)
+            lines.append(f'pdfpublisher_lecture_peak_rss_bytes{{publication="{_label(pub)}",language="{_label(lang)}",lecture="{lecture}"}} {rss}')
+        # The node exporter may read the file at any moment, never let it see half of it
+        write_atomic(path, "\n".join(lines) + "\n")
+
+def _value(field: str, value) -> str:
+    """Sample value of a field, counters are written exactly instead of in 6 significant digits."""
+    if field == "seconds":
+        return f"{value:.6f}"
+    return str(int(value))
+
+def _label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics()
@@ -0,0 +1,39 @@
+from pypdf import PdfWriter
+
+#############################################################################
+# Julkaistavien PDF-tiedostojen optimointi
+#############################################################################
+
+class ByteCounter:
+    """Write-only stream that only counts bytes, used to size a PDF without keeping it."""
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.size
+
+    def flush(self):
+        pass
+
+def written_size(writer: PdfWriter) -> int:
+    counter = ByteCounter()
+    writer.write(counter)
+    return counter.size
+
+def optimize_writer(writer: PdfWriter, level: int = 9):
+    """Compress page content streams and merge identical objects.
+
+    Lectures are put together from shared templates, so the same fonts, logos
+    and backgrounds end up in the writer once per source file. Identical
+    objects are merged into one and objects nothing refers to are dropped.
+    """
+    for page in writer.pages:
+        page.compress_content_streams(level=level)
+    writer.compress_identical_objects()
+
+def format_size(size: int) -> str:
+    return f"{size / 1024:.0f} kB" if size < 1048576 else f"{size / 1048576:.1f} MB"
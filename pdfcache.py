@@ -0,0 +1,71 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from pypdf import PdfReader
+
+#############################################################################
+# Jaettu PdfReader-välimuisti
+#############################################################################
+
+class ReaderCache:
+    """Process-wide LRU cache of parsed PDF files.
+
+    Readers are keyed on (path, size, mtime) so a changed file is parsed again.
+    pypdf reads the whole file into memory, so the file size is used as the
+    memory estimate of a cached reader.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = 0
+        self._readers = OrderedDict()
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def get(self, path) -> PdfReader:
+        """Return a parsed reader for path, parsing the file only if needed."""
+        path = Path(path)
+        st = path.stat()
+        name = str(path.resolve())
+        key = (name, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            if key in self._readers:
+                self._readers.move_to_end(key)
+                self.hits += 1
+                return self._readers[key][0]
+            self.misses += 1
+        reader = PdfReader(path)
+        with self._lock:
+            # Drop a stale version of the same file
+            old = self._keys.pop(name, None)
+            if old is not None and old in self._readers:
+                self._size -= self._readers.pop(old)[1]
+            if st.st_size > self.max_bytes:
+                return reader
+            self._readers[key] = (reader, st.st_size)
+            self._keys[name] = key
+            self._size += st.st_size
+            while self._size > self.max_bytes:
+                (oldname, _, _), (_, size) = self._readers.popitem(last=False)
+                self._keys.pop(oldname, None)
+                self._size -= size
+                self.evictions += 1
+        return reader
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        ratio = (self.hits / total * 100) if total else 0.0
+        return (f"PDF-välimuisti: {self.hits} osumaa, {self.misses} jäsennystä ({ratio:.0f}% osumia), "
+                f"{self.evictions} poistettu, {self._size / 1048576:.1f} MB käytössä")
+
+
+reader_cache = ReaderCache(512 * 1024 * 1024)
+
+def configure_reader_cache(config):
+    """Apply the memory ceiling from the [settings] section."""
+    reader_cache.max_bytes = int(float(config["settings"]["reader_cache_mb"]) * 1024 * 1024)
+
+def get_reader(path) -> PdfReader:
+    return reader_cache.get(path)
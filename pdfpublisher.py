@@ -1,19 +1,38 @@
 import argparse
-from database import init_db, connect_to_db
-from copy import deepcopy
+import multiprocessing
+from database import get_db, close_db
 import sys
-import re
 import io
-import shutil
+import os
+import json
+import hashlib
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from utils import *
 from pathlib import Path
 from pypdf import PdfReader, PdfWriter
 from pypdf._page import PageObject
+from pypdf.generic import NameObject
 from reportlab.pdfgen import canvas
 from reportlab.pdfbase.pdfmetrics import stringWidth
 from reportlab.lib import colors
 from classes import Course, create_course_object
 from config import load_config
+from dirindex import directory_index
+from buildplan import lecture_sources, plan_lecture_output, plan_compendium, compendium_filename, lecture_dir, build_plan, format_plan, plan_to_json
+from watcher import ReverseIndex, ChangeQueue, start_watcher, lectures_under
+from pdfcache import reader_cache, get_reader, configure_reader_cache
+from manifest import load_manifest, sha256_file
+from upload import create_uploader
+from sync import scan_tree, source_available, needs_copy, SyncReport
+from optimize import optimize_writer, written_size, format_size
+from metrics import metrics, Metrics, unit_key
+from memory import stream_pages, start_budget, check_budget, reset_peak_rss, peak_rss
+from images import downsample_images, get_image_cache, Image
+from linkcheck import configure_link_checker, link_checker
+from linkindex import load_link_index
+from atomicfile import write_atomic
 
 BOLD = "\033[1m"
 RESET = "\033[0m"
@@ -29,38 +48,51 @@ def split_to_lines(linecount, text):
     lines = [""]*linecount
     words = text.split()
     target = len(text)/linecount
-    line = 0
-    try:
-        while(True):
-            while len(lines[line])<target:
-                lines[line] = f"{lines[line]} {words.pop(0)}"
-            line += 1
-    except IndexError:
-        pass
+    i = 0
+    for line in range(linecount):
+        while i < len(words) and len(lines[line])<target:
+            lines[line] = f"{lines[line]} {words[i]}"
+            i += 1
+        if i == len(words):
+            break
     return lines
 
-def add_title(page: PageObject, lectureterm: str, lecturenum: int, lecturetitle: str,font: str,font_max_size: int,font_min_size: int,font_colour: str,maxlines: int):
+@lru_cache(maxsize=4096)
+def unit_width(line, font):
+    """Width of a line at font size 1, widths scale linearly with the font size."""
+    return stringWidth(line,font,1)
+
+def fit_font_size(text, font, font_max_size, font_min_size, textwidth):
+    """Largest font size between min and max where every line fits, None if none does."""
+    widest = max(text, key=lambda line: unit_width(line,font))
+    low, high = min(font_min_size,font_max_size), font_max_size
+    if stringWidth(widest,font,low) > textwidth:
+        return None
+    # Binary search instead of stepping down one point at a time
+    while low < high:
+        mid = (low + high + 1) // 2
+        if stringWidth(widest,font,mid) <= textwidth:
+            low = mid
+        else:
+            high = mid - 1
+    return low
 
-    #Page and text area width
-    width = float(page.mediabox.width)
-    height = float(page.mediabox.height)
+def render_title(width, height, lectureterm, lecturenum, lecturetitle, font, font_max_size, font_min_size, font_colour, maxlines) -> bytes:
+    """Render the title text as a transparent one page PDF overlay."""
     textwidth = width -100
     text = [f"{lectureterm} {lecturenum}",lecturetitle]
 
-    #Font size settings
-    font_size = font_max_size
-    
-    #Adjust font size
-    while not all(stringWidth(line,font,font_size) <= textwidth for line in text):
-        if font_size > font_min_size:
-            font_size -= 1
-        elif len(text) == maxlines:
+    #Adjust font size, add lines if the title does not fit with the minimum size
+    while True:
+        font_size = fit_font_size(text,font,font_max_size,font_min_size,textwidth)
+        if font_size is not None:
             break
-        else:
-            #Lisätään rivejä
-            newlinecount = len(text)
-            text[1:] = split_to_lines(newlinecount,lecturetitle)
-            font_size = font_max_size
+        if len(text) >= maxlines:
+            font_size = min(font_min_size,font_max_size)
+            break
+        #Lisätään rivejä
+        newlinecount = len(text)
+        text[1:] = split_to_lines(newlinecount,lecturetitle)
     packet = io.BytesIO()
     c = canvas.Canvas(packet, (width, height))
     c.setFont(font,font_size)
@@ -71,53 +103,58 @@ def add_title(page: PageObject, lectureterm: str, lecturenum: int, lecturetitle:
         c.drawCentredString(width / 2.0, drawheight,line)
         drawheight -= lineheight
     c.save()
-    packet.seek(0)
-    page.merge_page(PdfReader(packet).pages[0])
+    return packet.getvalue()
+
+# Rendered title overlays of this process, keyed like the disk cache
+title_overlays = {}
+
+def add_title(page: PageObject, lectureterm: str, lecturenum: int, lecturetitle: str,font: str,font_max_size: int,font_min_size: int,font_colour: str,maxlines: int,cache_dir: str = None):
+
+    #Page and text area width
+    width = float(page.mediabox.width)
+    height = float(page.mediabox.height)
+    args = [lectureterm, lecturenum, lecturetitle, font, font_max_size, font_min_size, font_colour, maxlines]
+    key = hashlib.sha256(json.dumps([width, height] + args, ensure_ascii=False).encode()).hexdigest()
+
+    overlay = title_overlays.get(key)
+    if overlay is None:
+        cachefile = Path(cache_dir) / f"{key}.pdf" if cache_dir else None
+        if cachefile is not None and cachefile.exists():
+            data = cachefile.read_bytes()
+        else:
+            data = render_title(width, height, *args)
+            if cachefile is not None:
+                write_atomic(cachefile, data)
+        overlay = PdfReader(io.BytesIO(data)).pages[0]
+        title_overlays[key] = overlay
+    page.merge_page(overlay)
 
 #############################################################################
 # Tiedostojen haku
 #############################################################################
-def load_directory(directory,lang = None):
-    files = {}
-    folder = Path(directory)
-    if lang is None:
-        dir_files = folder.glob("*.pdf")
-    elif lang == "":
-        dir_files = [f for f in folder.glob("*.pdf") if not re.compile(r"_\w{2}\.pdf$").search(f.name)]
-    else:
-        dir_files = folder.glob(f"*_{lang}.pdf")
-    for f in dir_files:
-        match = re.search(r'\d+', f.stem)
-        num = int(match.group()) if match else None
-        if isinstance(num, int):
-            mtime = f.stat().st_mtime
-            files[num] = {}
-            files[num]["file"] = f
-            files[num]["modtime"] = mtime
-    for f in folder.glob("*"):
-        mtime = f.stat().st_mtime
-        files[f.name] = {}
-        files[f.name]["file"] = f
-        files[f.name]["modtime"] = mtime
-    return files
-
 def load_full_directory(directory):
-    files = {}
-    folder = Path(directory)
-    for f in folder.glob("*"):
-        mtime = f.stat().st_mtime
-        files[f.name] = {}
-        files[f.name]["file"] = f
-        files[f.name]["modtime"] = mtime
-    return files
+    return dict(directory_index.listing(directory))
 
-def link_health_check(config, pub, silent):
-    if not silent:
-        print("Tarkistetaan linkit")
+def prefetch_directories(config,publications):
+    """Scan every folder this run will look at in one parallel pass."""
+    dirs = [config['settings']['lecture_slides_dir']]
+    for pub in publications:
+        dirs.append(config[pub]['course_slides_dir'])
+        try:
+            lectures = int(config[pub]['lectures'])
+        except ValueError:
+            continue
+        for n in range(1, lectures+1):
+            dirs.append(f"{config['settings']['lecture_slides_dir']}/{n:02}")
+            dirs.append(f"{config[pub]['course_slides_dir']}/{n:02}")
+            dirs.append(f"{config[pub]['publish_dir']}/{config[pub]['lectureterm']} {n:02}")
+    directory_index.prefetch(dirs)
+
+def published_pdfs(config, publications):
+    """(course name, path) of every PDF published for the publications."""
+    files = []
     for pub in publications:
         courseObject = create_course_object(config, pub)
-        if not silent:
-            print(f"Tarkistetaan kurssi {courseObject.name}")
         for n in range(1, courseObject.lectures + 1):
             matpubdir = f"{courseObject.publication_dir}/{courseObject.lectureterm} {n:02}"
             matpubpath = Path(matpubdir)
@@ -125,64 +162,102 @@ def link_health_check(config, pub, silent):
                 print(f"Skipping {matpubdir}: not found")
                 continue
             materials_published = load_full_directory(matpubdir)
-            # Run health check for links
-            files = []
-            
             for v in materials_published.values():
-                files.append(v.get("file"))
-
-            for file in files:
-                dead, alive = run_health_check(file._raw_paths[0])
-
-                if dead:
-                    cur = connect_to_db()
-                    add_dead_links_to_db(cur, file._raw_paths[0], dead)
-                    print("Seuraavat linkit eivät toimi:")
-                    for link in dead:
-                        print(f"{link.get('file')} (sivu {link.get('page_number')}): {link.get('url')} virhekoodi: {link.get('error_code')}")  
-                else:
-                    if not silent:
-                        print(f"Tiedoston {file.name} kaikki linkit toimivat oikein.")
-    sys.exit(0)
+                if v["file"].suffix.lower() == ".pdf":
+                    files.append((courseObject.name, str(v["file"])))
+        if config[pub].getboolean("compendium"):
+            langs = [""] + [lang for lang in config[pub]['translate_to'].split(",") if lang]
+            for lang in langs:
+                suffix = f"_{lang}.pdf" if lang != "" else ".pdf"
+                compendium = Path(courseObject.publication_dir) / compendium_filename(courseObject, suffix)
+                if compendium.exists():
+                    files.append((courseObject.name, str(compendium)))
+    return files
 
+def save_link_status(files, dead, alive):
+    """Store the results of a check run, files maps every checked file to its course."""
+    record_link_status(get_db(), files, dead, alive)
 
-def checkLinksOnFile(file, silent):
-    dead, alive = run_health_check(file)
+def report_dead_links(file, dead, silent):
     if dead:
-        cur = connect_to_db()
-        add_dead_links_to_db(cur, file, dead)
         print("Seuraavat linkit eivät toimi:")
         for link in dead:
-            print(f"{link.get('file')} (sivu {link.get('page_number')}): {link.get('url')} virhekoodi: {link.get('error_code')}")  
+            inferred = " (päätelty, palvelin ei vastannut)" if link.get("inferred") else ""
+            print(f"{link.get('file')} (sivu {link.get('page_number')}): {link.get('url')} virhekoodi: {link.get('error_code')}{inferred}")
     else:
         if not silent:
-            print(f"Tiedoston {file.name} kaikki linkit toimivat oikein.")
+            print(f"Tiedoston {Path(file).name} kaikki linkit toimivat oikein.")
+
+def link_health_check(config, publications, silent):
+    """Check the links of every published PDF in one concurrent batch.
+
+    The links of files whose content has not changed come from the link index,
+    the rest are extracted in worker processes while the first links are
+    already being checked.
+    """
+    if not silent:
+        print("Tarkistetaan linkit")
+    files = published_pdfs(config, publications)
+    manifest = load_manifest(config)
+    index = load_link_index(config, manifest)
+    workers = int(config['settings']['linkextract_workers'])
+    dead, alive = test_link(index.iter_links([file for course, file in files], workers))
+    # The manifest is only read, a publish run may be writing it
+    index.save()
+    save_link_status({file: course for course, file in files}, dead, alive)
+    close_db()
+    course = None
+    for name, file in files:
+        if name != course and not silent:
+            print(f"Tarkistetaan kurssi {name}")
+        course = name
+        report_dead_links(file, [link for link in dead if link["file"] == file], silent)
+    link_checker.close()
+    if not silent:
+        print(index.stats())
+        print(link_checker.stats())
     sys.exit(0)
 
-def publish_lectures(courseObject,config,lang):
-        #Load slide update dates
-        pubslides = load_directory(courseObject.course_slides_dir,lang)
-        slide_updates = load_directory(config['settings']['lecture_slides_dir'])
-        if not lang == "":
-            suffix = f"_{lang}.pdf"
-        else:
-            suffix = ".pdf"
-        # Load header/footer slides
-        # Should be moved to courseObject class to remove need to pass config here...
-
-        pStartingslides = Path(courseObject.course_slides_dir) / f"{config['settings']['headerfile']}{suffix}"
-        pDividerslides = Path(courseObject.course_slides_dir) / f"{config['settings']['dividerfile']}{suffix}"
-        pEndingslides = Path(courseObject.course_slides_dir) / f"{config['settings']['footerfile']}{suffix}"
-
-        
-        aOK = pStartingslides.exists()
-        kOK = pDividerslides.exists()
-        lOK = pEndingslides.exists()
-        if aOK and kOK and lOK:
-            Startingslides = PdfReader(Path(courseObject.course_slides_dir) / f"{config['settings']['headerfile']}{suffix}")
-            Dividerslides = PdfReader(Path(courseObject.course_slides_dir) / f"{config['settings']['dividerfile']}{suffix}")
-            Endingslides = PdfReader(Path(courseObject.course_slides_dir) / f"{config['settings']['footerfile']}{suffix}")
+
+def checkLinksOnFile(file, silent):
+    dead, alive = run_health_check(file)
+    save_link_status({file: None}, dead, alive)
+    close_db()
+    report_dead_links(file, dead, silent)
+    link_checker.close()
+    sys.exit(0)
+
+def link_report(course, since):
+    """Print the dead links in the link status database, oldest failures first."""
+    rows = query_dead_links(get_db(), course or None, since)
+    close_db()
+    if not rows:
+        print("Ei rikkinäisiä linkkejä.")
+        sys.exit(0)
+    current = ()
+    for name, file, page, url, error_code, first_failed, last_checked, fail_count, inferred in rows:
+        if name != current:
+            print(f"{BOLD}{name or 'Ei kurssia'}{RESET}")
+            current = name
+        print(f"  {file} (sivu {page}): {url} virhekoodi: {error_code}{' (päätelty)' if inferred else ''}")
+        if first_failed is None:
+            print(f"    \\_päätelty, ei vielä tarkistettu, viimeksi {last_checked}")
         else:
+            print(f"    \\_rikki {first_failed} alkaen, {fail_count} epäonnistunutta tarkistusta, viimeksi {last_checked}")
+    print(f"Rikkinäisiä linkkejä {len(rows)}")
+    sys.exit(0)
+
+def load_lecture_sources(courseObject,config,lang):
+        """Look up the slide folders and check header/divider/footer for one language.
+
+        Returns a dict describing where the lecture inputs are, or None if the
+        title slides are not available yet.
+        """
+        sources = lecture_sources(courseObject,config,lang)
+        aOK = sources["header_ok"]
+        kOK = sources["divider_ok"]
+        lOK = sources["footer_ok"]
+        if not (aOK and kOK and lOK):
             print(f"  \\_{RED}Otsikkokalvoja ei ole vielä saatavilla! {RESET}")
             if aOK:
                 print(f"    \\_{GREEN}Aloituskalvo ok{RESET}")
@@ -196,138 +271,531 @@ def publish_lectures(courseObject,config,lang):
                 print(f"    \\_{GREEN}Lopetuskalvo ok{RESET}")
             else:
                 print(f"    \\_{RED}Lopetuskalvo puuttuu{RESET}")
-            return
+            return None
+        return sources
 
-        # Go through all or a subset of lectures
-        for n in range(1, courseObject.lectures+1):
-            print(f"  \\_{config[pub]['lectureterm']} {n} ({courseObject.lecture_list[n-1].name})") 
+def plan_lecture(courseObject,config,pub,lang,n,sources,manifest,silent):
+        """Check whether lecture n needs publishing.
 
-            # Check if the publication folder exists, create if necessary, check published file
-            matpubdir = f"{courseObject.publication_dir}/{courseObject.lectureterm} {n:02}"
-            matpubpath = Path(matpubdir)
-            if not matpubpath.exists():
-                matpubpath.mkdir(parents=True, exist_ok=True)
-            filename = re.sub(r'[\\/]', '', f"{n:02} - {courseObject.filename_prefix} {courseObject.lectureterm.lower()} {n} – {courseObject.lecture_list[n-1].name}{suffix}")[:200]
-            published_slides = matpubpath / filename
-
-            # First check the slides, later additional materials
-            updateFlag = False
-            missingSlides = False
-
-            for topic in courseObject.lecture_list[n-1].topic_list:
-                topic = f"{topic}{suffix}"
-                if not topic in slide_updates:
-                    print(f"    \\_{RED}Aihe {topic}: luentokalvot eivät vielä saatavilla{RESET}")
-                    missingSlides = True
-                elif published_slides.exists() and slide_updates[topic]["modtime"] <= published_slides.stat().st_mtime:
-                    if not silent:
-                        print(f"    \\_{WHITE}Aihe {topic}: ajan tasalla!{RESET}")
-                else:
-                    if not silent:
-                        print(f"    \\_{BOLD}Aihe {topic}: luentokalvot päivitetty, voi julkaista!{RESET}")
-                    updateFlag = True
-            if not n in pubslides:
+        Prints the status of every input and returns the plan entry of the
+        lecture if it needs to be assembled, otherwise None.
+        """
+        print(f"  \\_{config[pub]['lectureterm']} {n} ({courseObject.lecture_list[n-1].name})") 
+
+        # Check if the publication folder exists, create if necessary
+        matpubpath = Path(lecture_dir(courseObject,n))
+        if not matpubpath.exists():
+            matpubpath.mkdir(parents=True, exist_ok=True)
+
+        entry = plan_lecture_output(courseObject,config,pub,lang,n,sources,manifest)
+        for check in entry["checks"]:
+            kind, name, state = check["kind"], check["name"], check["state"]
+            if kind == "topic" and state == "missing":
+                print(f"    \\_{RED}Aihe {name}: luentokalvot eivät vielä saatavilla{RESET}")
+            elif kind == "course" and state == "missing":
                 print(f"    \\_{RED}Kurssikohtaiset täydentävät kalvot eivät vielä saatavilla!{RESET}")	    
-                missingSlides = True
-            elif published_slides.exists() and pubslides[n]["modtime"] <= published_slides.stat().st_mtime:
-                if not silent:
-                    print(f"    \\_{WHITE}Kurssikohtaiset täydentävät kalvot ajan tasalla!{RESET}")
+            elif silent:
+                continue
+            elif kind == "topic" and state == "current":
+                print(f"    \\_{WHITE}Aihe {name}: ajan tasalla!{RESET}")
+            elif kind == "topic":
+                print(f"    \\_{BOLD}Aihe {name}: luentokalvot päivitetty, voi julkaista!{RESET}")
+            elif kind == "course" and state == "current":
+                print(f"    \\_{WHITE}Kurssikohtaiset täydentävät kalvot ajan tasalla!{RESET}")
+            elif kind == "course":
+                print(f"    \\_{BOLD}Kurssikohtaiset täydentävät kalvot päivitetty, voi julkaista!{RESET}")
             else:
-                if not silent:
-                    print(f"    \\_{BOLD}Kurssikohtaiset täydentävät kalvot päivitetty, voi julkaista!{RESET}")
-                updateFlag = True
-            if updateFlag and not missingSlides:
-                if not published_slides.exists():
-                    if not silent:
-                        print(f"    \\_{BOLD}Ei vielä julkaistu -> julkaistaan{RESET}")
-                else:
-                    if not silent:
-                        print(f"    \\_{BOLD}Materiaalia on päivitetty -> julkaistaan{RESET}")
+                print(f"    \\_{BOLD}Otsikkokalvot, asetukset tai sivujärjestys muuttuneet, voi julkaista!{RESET}")
+        if not entry["dirty"]:
+            return None
+        if not silent:
+            if "not published" in entry["reasons"]:
+                print(f"    \\_{BOLD}Ei vielä julkaistu -> julkaistaan{RESET}")
+            else:
+                print(f"    \\_{BOLD}Materiaalia on päivitetty -> julkaistaan{RESET}")
+        return entry
+
+def plan_lectures(courseObject,config,pub,lang,manifest,silent):
+        """Plan all lectures of one publication and language, returns the dirty units."""
+        sources = load_lecture_sources(courseObject,config,lang)
+        if sources is None:
+            return []
+        units = []
+        for n in range(1, courseObject.lectures+1):
+            with metrics.stage("plan"):
+                unit = plan_lecture(courseObject,config,pub,lang,n,sources,manifest,silent)
+            if unit is not None:
+                units.append(unit)
+        with metrics.stage("plan"):
+            compendium = plan_compendium_unit(courseObject,config,pub,lang,manifest,silent)
+        if compendium is not None:
+            units.append(compendium)
+        return units
+
+def plan_compendium_unit(courseObject,config,pub,lang,manifest,silent):
+        """Check whether the compendium of one publication and language needs publishing.
+
+        Returns the plan entry if it has to be assembled, otherwise None.
+        """
+        unit = plan_compendium(courseObject,config,pub,lang,lecture_sources(courseObject,config,lang),manifest)
+        if unit is None:
+            return None
+        print(f"  \\_Kooste ({Path(unit['output']).name})")
+        if unit["missing"]:
+            print(f"    \\_{RED}Odottaa puuttuvia luentoja: {', '.join(unit['missing'])}{RESET}")
+            return None
+        if not unit["dirty"]:
+            if not silent:
+                print(f"    \\_{WHITE}Ajan tasalla!{RESET}")
+            return None
+        if not silent:
+            if "not published" in unit["reasons"]:
+                print(f"    \\_{BOLD}Ei vielä julkaistu -> julkaistaan{RESET}")
+            else:
+                changed = [reason.removeprefix("changed: ") for reason in unit["reasons"] if reason.startswith("changed: ")]
+                for label in changed:
+                    print(f"    \\_{BOLD}{label} muuttunut -> julkaistaan{RESET}")
+                if not changed:
+                    print(f"    \\_{BOLD}Luentojen järjestys muuttunut -> julkaistaan{RESET}")
+        return unit
+
+def load_reader(path,stage):
+        """Reader of path from the shared cache, counting the bytes parsed on a miss."""
+        misses = reader_cache.misses
+        reader = get_reader(path)
+        if reader_cache.misses != misses:
+            stage.bytes_read += os.path.getsize(path)
+        return reader
+
+def add_source_pages(newslides,path,budget,stage):
+        """Append every page of path to newslides, returns the index of the first one."""
+        first = len(newslides.pages)
+        if budget:
+            stage.bytes_read += os.path.getsize(path)
+            stream_pages(newslides, path)
+            check_budget(budget, Path(path).name)
+        else:
+            for page in load_reader(path, stage).pages:
+                newslides.add_page(page)
+        return first
+
+def add_lecture_pages(newslides,unit,stats,key):
+        budget = unit["memory_budget"]
+        if budget:
+            # One source at a time, each is released once its pages are copied
+            with stats.stage("assemble", key) as stage:
+                for path in [unit["header"], *unit["topics"], unit["divider"], unit["course"], unit["footer"]]:
+                    add_source_pages(newslides, path, budget, stage)
+                stage.pages = len(newslides.pages)
+            with stats.stage("title", key):
+                add_title(newslides.pages[0],**unit["title"],cache_dir=unit["title_cache"])
+            return
 
+        with stats.stage("parse", key) as stage:
+            Startingslides = load_reader(unit["header"], stage)
+            Dividerslides = load_reader(unit["divider"], stage)
+            Endingslides = load_reader(unit["footer"], stage)
+            Topicslides = [load_reader(topic, stage) for topic in unit["topics"]]
+            Courseslides = load_reader(unit["course"], stage)
+
+        # Take starting slide, update course and lecture name.
+        # The title is merged into the writer's own copy of the page, the
+        # cached reader's page is shared between lectures and must stay intact.
+        with stats.stage("title", key):
+            firstslide = newslides.add_page(Startingslides.pages[0])
+            add_title(firstslide,**unit["title"],cache_dir=unit["title_cache"])
+
+        with stats.stage("assemble", key) as stage:
+            for page in Startingslides.pages[1:]:
+                newslides.add_page(page)
+
+            # make lecture slides from topics
+            for Lectureslides in Topicslides:
+                for page in Lectureslides.pages:
+                    newslides.add_page(page)
+
+            # Insert divider slides
+            for page in Dividerslides.pages:
+                newslides.add_page(page)
+
+            # Insert course-specific slides into the placeholder
+            for page in Courseslides.pages:
+                newslides.add_page(page)
+
+            # Insert footer slides
+            for page in Endingslides.pages:
+                newslides.add_page(page)
+            stage.pages = len(newslides.pages)
+
+def add_compendium_pages(newslides,unit,stats,key):
+        """Every lecture of the compendium in order, with a bookmark per lecture and topic.
+
+        Without --jobs and a memory budget the sources come from the shared
+        reader cache, so the PDFs parsed for the lectures of this run are not
+        parsed again. A worker process or a memory budget reads them again.
+        """
+        budget = unit["memory_budget"]
+        with stats.stage("assemble", key) as stage:
+            for member in unit["members"]:
+                title = member["title"]
+                first = add_source_pages(newslides, member["header"], budget, stage)
+                # Every lecture adds the same header page, its content stream is
+                # shared inside the writer and has to be copied before the title is merged
+                header = newslides.pages[first]
+                contents = header.get_contents()
+                if contents is not None:
+                    del header[NameObject("/Contents")]
+                    header.replace_contents(contents)
+                add_title(header,**title,cache_dir=unit["title_cache"])
+                lecture = newslides.add_outline_item(f"{title['lectureterm']} {title['lecturenum']}: {title['lecturetitle']}", first)
+                for topic in member["topics"]:
+                    page = add_source_pages(newslides, topic, budget, stage)
+                    newslides.add_outline_item(Path(topic).name.removesuffix(unit["suffix"]), page, parent=lecture)
+                for path in (member["divider"], member["course"], member["footer"]):
+                    add_source_pages(newslides, path, budget, stage)
+            stage.pages = len(newslides.pages)
+
+def assemble_lecture(unit,silent,stats):
+        """Assemble and write one lecture or compendium PDF.
+
+        Returns (ok, log lines), the lines are returned instead of printed so
+        that parallel workers do not interleave their output.
+        """
+        log = []
+        ok = True
+        filename = Path(unit["output"]).name
+        key = unit_key(unit)
+        budget = unit["memory_budget"]
+        reset_peak_rss()
+        start_budget()
+        try:
+            newslides = PdfWriter()
+            if unit["kind"] == "compendium":
+                add_compendium_pages(newslides,unit,stats,key)
+            else:
+                add_lecture_pages(newslides,unit,stats,key)
+
+            # Downsample images above the DPI limit
+            if unit["images"] is not None:
+                with stats.stage("images", key) as stage:
+                    stage.bytes_read, stage.bytes_written = downsample_images(newslides, get_image_cache(unit["image_cache"]), **unit["images"])
+                if stage.bytes_read and not silent:
+                    log.append(f"    \\_{WHITE}Kuvat pienennetty {format_size(stage.bytes_read)} -> {format_size(stage.bytes_written)}{RESET}")
+                check_budget(budget, "images")
+
+            # Merge duplicate fonts and images, compress streams
+            if unit["optimize"]:
+                with stats.stage("optimize", key):
+                    # Serialising the whole PDF only for the size line is not free
+                    before = written_size(newslides) if not silent else None
+                    optimize_writer(newslides)
+                check_budget(budget, "optimize")
+
+            # Write to file
+            if not silent:
+                log.append(f"    \\_{BOLD}Tallennetaan PDF{RESET}")
+            with stats.stage("write", key) as stage:
+                with open(unit["staging"],"wb") as f:
+                    newslides.write(f)
+                stage.bytes_written = Path(unit["staging"]).stat().st_size
+            if unit["optimize"] and not silent:
+                log.append(f"    \\_{WHITE}Optimoitu {format_size(before)} -> {format_size(stage.bytes_written)}{RESET}")
+        except MemoryError as e:
+            ok = False
+            log.append(f"    \\_{RED}❌ Error: Publishing '{filename}' exceeds the memory budget: {e}{RESET}")
+        except TimeoutError:
+            ok = False
+            log.append(f"    \\_{RED}❌ Error: Connection timed out while accessing '{filename}'. Network drive issue?{RESET}")        
+        except FileNotFoundError:
+            ok = False
+            log.append(f"    \\_{RED}❌ Error: The file '{filename}' could not be found.{RESET}")
+        peak = peak_rss()
+        if peak is not None:
+            stats.peak(key, peak)
+            if not silent:
+                log.append(f"    \\_{WHITE}Muistin huippu {format_size(peak)}{RESET}")
+        return ok, log
+
+def run_lecture_unit(unit,silent):
+        """Worker entry point, an unexpected error only fails this one lecture.
+
+        Returns (ok, log lines, measurements of this lecture or None).
+        """
+        stats = Metrics(metrics.enabled)
+        try:
+            ok, log = assemble_lecture(unit,silent,stats)
+        except Exception as e:
+            ok, log = False, [f"    \\_{RED}❌ Error: Publishing '{Path(unit['output']).name}' failed: {e}{RESET}"]
+        if not ok:
+            # Never upload a partially written output
+            Path(unit["staging"]).unlink(missing_ok=True)
+        return ok, log, stats.to_dict() if stats.enabled else None
+
+def upload_lecture(unit,manifest,uploader):
+        """Queue a staged lecture for upload, the manifest is updated only once it is in place.
+
+        The hash of the staged file is seeded for the published one, so the
+        link index never has to read it back from the share.
+        """
+        sha = sha256_file(unit["staging"])
+        def done(ok):
+            if ok:
+                manifest.record(unit["output"], unit["digest"], unit["inputs"])
+                manifest.seed_hash(unit["output"], sha)
+        uploader.submit(unit["staging"], unit["output"], on_done=done, remove_src=True, label=unit_key(unit))
+
+def _init_worker(cache_bytes,metrics_enabled):
+        reader_cache.max_bytes = cache_bytes
+        metrics.enabled = metrics_enabled
+
+def publish_lectures(courseObject,config,pub,lang,manifest,uploader,silent):
+        sources = load_lecture_sources(courseObject,config,lang)
+        if sources is None:
+            return
+        # Go through all or a subset of lectures
+        for n in range(1, courseObject.lectures+1):
+            with metrics.stage("plan"):
+                unit = plan_lecture(courseObject,config,pub,lang,n,sources,manifest,silent)
+            if unit is not None:
+                unit["staging"] = str(uploader.staging_path(unit["output"]))
+                ok, log, stats = run_lecture_unit(unit,silent)
+                metrics.merge(stats)
+                for line in log:
+                    print(line)
+                if ok:
+                    upload_lecture(unit,manifest,uploader)
+        publish_compendium(courseObject,config,pub,lang,manifest,uploader,silent)
+
+def publish_compendium(courseObject,config,pub,lang,manifest,uploader,silent):
+        with metrics.stage("plan"):
+            unit = plan_compendium_unit(courseObject,config,pub,lang,manifest,silent)
+        if unit is None:
+            return
+        unit["staging"] = str(uploader.staging_path(unit["output"]))
+        ok, log, stats = run_lecture_unit(unit,silent)
+        metrics.merge(stats)
+        for line in log:
+            print(line)
+        if ok:
+            upload_lecture(unit,manifest,uploader)
+
+def publish_lectures_parallel(units,jobs,manifest,uploader,silent):
+        """Assemble planned lecture units in a process pool.
+
+        Output of each lecture is printed as one block when it finishes. A
+        worker that dies (for example killed for running out of memory)
+        breaks the whole pool, the lectures that had not finished then are
+        assembled again each in a process of its own, so only the lecture
+        that kills its process fails.
+        """
+        if not units:
+            return
+        print(f"\\_Julkaistaan {len(units)} luentoa {jobs} rinnakkaisella prosessilla")
+        failed = 0
+        for unit in units:
+            unit["staging"] = str(uploader.staging_path(unit["output"]))
+
+        def finish(unit,result):
+            nonlocal failed
+            ok, log, stats = result
+            lang = unit["lang"] if unit["lang"] else "fi"
+            metrics.merge(stats)
+            if ok:
+                upload_lecture(unit,manifest,uploader)
+            else:
+                failed += 1
+            print(f"  \\_{unit['pub']} [{lang}] {unit['label']}")
+            for line in log:
+                print(line)
+
+        leftover = []
+        # The uploader threads are already running, forking them is not safe
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(reader_cache.max_bytes,metrics.enabled),
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = {pool.submit(run_lecture_unit, unit, silent): unit for unit in units}
+            for future in as_completed(futures):
+                unit = futures[future]
                 try:
-                    newslides = PdfWriter()
-
-                    # Take starting slide, update course and lecture name
-                    firstslide = deepcopy(Startingslides.pages[0])
-                    add_title(firstslide,courseObject.lectureterm,n,courseObject.lecture_list[n-1].name,config["titlefont"]["font"],int(config["titlefont"]["font_max_size"]),int(config["titlefont"]["font_max_size"]),config["titlefont"]["colour"],int(config["titlefont"]["maxlines"]));
-
-                    newslides.add_page(firstslide)
-                    for page in Startingslides.pages[1:]:
-                        newslides.add_page(page)
-
-                    # make lecture slides from topics
-                    for topic in courseObject.lecture_list[n-1].topic_list:
-                        Lectureslides = PdfReader(slide_updates[f"{topic}{suffix}"]["file"])
-                        for page in Lectureslides.pages:
-                            newslides.add_page(page)
-
-                    # Insert divider slides
-                    for page in Dividerslides.pages:
-                        newslides.add_page(page)
-
-                    # Insert course-specific slides into the placeholder
-                    Courseslides = PdfReader(pubslides[n]["file"])
-                    for page in Courseslides.pages:
-                        newslides.add_page(page)
-
-                    # Insert footer slides
-                    for page in Endingslides.pages:
-                        newslides.add_page(page)
-
-                    # Write to file
-                    if not silent:
-                        #print("Luodaan pdf...")
-                        print(f"    \\_{BOLD}Tallennetaan PDF{RESET}")
-                    filename = re.sub(r'[\\/]', '', f"{n:02} - {config[pub]['filename_prefix']} {config[pub]['lectureterm']} {n}: {courseObject.lecture_list[n-1].name}{suffix}")[:200]
-                    with open(published_slides,"wb") as f:
-                        newslides.write(f)
-                except TimeoutError:
-                    print(f"    \\_{RED}❌ Error: Connection timed out while accessing '{filename}'. Network drive issue?{RESET}")        
-                except FileNotFoundError:
-                    print(f"    \\_{RED}❌ Error: The file '{filename}' could not be found.{RESET}")
-                 
-
-def publish_materials(courseObject,config):
+                    result = future.result()
+                except BrokenProcessPool:
+                    leftover.append(unit)
+                    continue
+                except Exception as e:
+                    result = False, [f"    \\_{RED}❌ Error: Worker failed: {e}{RESET}"], None
+                finish(unit,result)
+        if leftover:
+            print(f"\\_{RED}Työprosessi kaatui, {len(leftover)} luentoa julkaistaan omissa prosesseissaan{RESET}")
+            with ThreadPoolExecutor(max_workers=jobs) as threads:
+                futures = {threads.submit(run_isolated_unit, unit, silent): unit for unit in leftover}
+                for future in as_completed(futures):
+                    finish(futures[future],future.result())
+        if failed:
+            print(f"\\_{RED}{failed}/{len(units)} luennon julkaisu epäonnistui{RESET}")
+
+def run_isolated_unit(unit,silent):
+        """Assemble one unit in a process of its own, if that process dies only this unit fails."""
+        try:
+            with ProcessPoolExecutor(max_workers=1, initializer=_init_worker, initargs=(reader_cache.max_bytes,metrics.enabled),
+                                     mp_context=multiprocessing.get_context("spawn")) as pool:
+                return pool.submit(run_lecture_unit, unit, silent).result()
+        except BrokenProcessPool:
+            Path(unit["staging"]).unlink(missing_ok=True)
+            return False, [f"    \\_{RED}❌ Error: Worker process died while publishing '{Path(unit['output']).name}' (out of memory?){RESET}"], None
+        except Exception as e:
+            return False, [f"    \\_{RED}❌ Error: Worker failed: {e}{RESET}"], None
+
+def publish_materials(courseObject,config,uploader,manifest,silent):
+    """Sync the material folders of every lecture to its publication folder.
+
+    Subfolders are included, files are compared by size and cached hash and
+    copied through the uploader's thread pool. With prune_materials files that
+    were synced earlier but removed from the source are deleted.
+    """
+    prune = config['settings'].getboolean('prune_materials')
+    reports = []
     # Go through all or a subset of lectures
     for n in range(1, courseObject.lectures+1):
         # Check materials
         # Check if the publication folder exists, create if necessary, check published file
-        matpubdir = f"{courseObject.publication_dir}/{courseObject.lectureterm} {n:02}"
+        matpubdir = lecture_dir(courseObject,n)
         matpubpath = Path(matpubdir)
         if not matpubpath.exists():
             matpubpath.mkdir(parents=True, exist_ok=True)
-        materials_for_all = load_full_directory(f"{config['settings']['lecture_slides_dir']}/{n:02}")
-        materials_forcourse = load_full_directory(f"{courseObject.course_slides_dir}/{n:02}")
-        materials_published = load_full_directory(matpubdir)
-        materialcount = len(materials_for_all) + len(materials_forcourse)
-        if materialcount == 0:
-            print(f"  \\_{config[pub]['lectureterm']} {n}: ei materiaaleja")
+        # Course-specific files override common files with the same name
+        roots = [Path(config['settings']['lecture_slides_dir']) / f"{n:02}", Path(courseObject.course_slides_dir) / f"{n:02}"]
+        materials = scan_tree(roots[0])
+        materials.update(scan_tree(roots[1]))
+        materials_published = scan_tree(matpubdir)
+        report = SyncReport()
+        if len(materials) == 0:
+            print(f"  \\_{courseObject.lectureterm} {n}: ei materiaaleja")
         else:
-            print(f"  \\_{config[pub]['lectureterm']} {n}: yhteensä {materialcount} materiaalia jaettavaksi") 
-            for filename, file in materials_for_all.items():
-                if filename not in materials_published:
-                    if not silent:
-                        print(f"    \\_{BOLD}Tiedostoa {filename} ei ole vielä julkaistu, julkaistaan.{RESET}")
-                    shutil.copy2(file['file'], matpubpath / filename)
-                elif file["modtime"] > materials_published[filename]["modtime"]:
-                    if not silent:
-                        print(f"    \\_{BOLD}Tiedostosta {filename} on uudempi versio, julkaistaan.{RESET}")
-                    shutil.copy2(file['file'], materials_published[filename]["file"])
-                else:
-                    if not silent:
-                        print(f"    \\_{WHITE}Tiedosto {filename} on ajan tasalla{RESET}")
-            for filename, file in materials_forcourse.items():
-                if filename not in materials_published:
-                    if not silent:
-                        print(f"    \\_{BOLD}Tiedostoa {filename} ei ole vielä julkaistu, julkaistaan.{RESET}")
-                    shutil.copy2(file['file'], matpubpath / filename)
-                elif file["modtime"] > materials_published[filename]["modtime"]:
-                    if not silent:
-                        print(f"    \\_{BOLD}Tiedostosta {filename} on uudempi versio, julkaistaan.{RESET}")
-                    shutil.copy2(file['file'], materials_published[filename]["file"])
+            print(f"  \\_{courseObject.lectureterm} {n}: yhteensä {len(materials)} materiaalia jaettavaksi") 
+        for filename, file in materials.items():
+            dest = matpubpath / filename
+            reason = needs_copy(file, materials_published.get(filename), dest, manifest)
+            if not reason:
+                if not silent:
+                    print(f"    \\_{WHITE}Tiedosto {filename} on ajan tasalla{RESET}")
+                continue
+            if not silent:
+                if reason == "new":
+                    print(f"    \\_{BOLD}Tiedostoa {filename} ei ole vielä julkaistu, julkaistaan.{RESET}")
                 else:
+                    print(f"    \\_{BOLD}Tiedostosta {filename} on uudempi versio, julkaistaan.{RESET}")
+            sha = manifest.file_hash(file["file"])
+            count = report.done(file["size"])
+            def done(ok, dest=dest, sha=sha, count=count):
+                if ok:
+                    manifest.seed_hash(dest, sha)
+                count(ok)
+            report.futures.append(uploader.submit(file["file"], dest, on_done=done))
+        # An unreachable source or one that lost every file is more likely a
+        # share that is not mounted than removed materials, nothing is pruned
+        # and the files synced before are remembered for the next run
+        synced = manifest.synced_materials(matpubdir)
+        kept = set()
+        if not all(source_available(root) for root in roots):
+            print(f"    \\_{RED}Materiaalikansio ei ole käytettävissä, julkaistuja tiedostoja ei poisteta{RESET}")
+            kept = synced
+        elif prune and not materials and synced:
+            print(f"    \\_{RED}Materiaalikansio on tyhjä, {len(synced)} julkaistua tiedostoa jätetään paikalleen{RESET}")
+            kept = synced
+        elif prune:
+            for filename in synced - materials.keys():
+                if filename in materials_published:
                     if not silent:
-                        print(f"    \\_{WHITE}Tiedosto {filename} on ajan tasalla{RESET}")
+                        print(f"    \\_{BOLD}Tiedosto {filename} on poistettu lähteestä, poistetaan.{RESET}")
+                    try:
+                        (matpubpath / filename).unlink()
+                        report.pruned += 1
+                    except OSError as e:
+                        print(f"    \\_{RED}❌ Error: Could not remove '{filename}': {e}{RESET}")
+        manifest.record_materials(matpubdir, materials.keys() | kept)
+        reports.append((n, report))
+
+    # Per-lecture summary once the copies are done
+    for n, report in reports:
+        report.wait()
+        if report.futures or report.pruned:
+            failed = f", {RED}{report.failed} epäonnistui{RESET}" if report.failed else ""
+            pruned = f", {report.pruned} poistettu" if report.pruned else ""
+            print(f"  \\_{courseObject.lectureterm} {n}: siirretty {report.files} tiedostoa ({format_size(report.bytes)}) {report.elapsed:.1f} s{pruned}{failed}")
+
+    
+def watch_directories(config,publications):
+    """Folders whose files can affect a lecture PDF."""
+    dirs = [config['settings']['lecture_slides_dir']]
+    for pub in publications:
+        dirs.append(config[pub]['course_slides_dir'])
+    return dirs
+
+def material_roots(config,pub):
+    """Material folders of a publication with their lecture numbers: {folder: n}."""
+    roots = {}
+    for n in range(1, int(config[pub]['lectures'])+1):
+        roots[os.path.normpath(f"{config['settings']['lecture_slides_dir']}/{n:02}")] = n
+        roots[os.path.normpath(f"{config[pub]['course_slides_dir']}/{n:02}")] = n
+    return roots
+
+def watch_publications(config,publications,manifest,uploader,silent):
+    """Republish only the lectures whose inputs change, until interrupted."""
+    courses = {pub: create_course_object(config, pub) for pub in publications}
+    index = ReverseIndex()
+    for entry in build_plan(config,publications,manifest):
+        if entry["kind"] == "lecture":
+            index.update(entry)
+    queue = ChangeQueue()
+    roots = {pub: material_roots(config,pub) for pub in publications}
+    trees = [root for pub_roots in roots.values() for root in pub_roots]
+    watcher, method = start_watcher(watch_directories(config,publications), queue,
+                                    config['settings']['watch_mode'], float(config['settings']['watch_interval']), trees)
+    print(f"Seurataan muutoksia ({method}), lopetus Ctrl+C")
+    try:
+        while True:
+            changed = queue.wait_batch(float(config['settings']['watch_debounce']))
+            for folder in {os.path.dirname(path) for path in changed}:
+                directory_index.invalidate(folder)
+            keys = index.affected(changed)
+            if not silent:
+                print(f"*****************************************\n{len(changed)} muuttunutta tiedostoa, tarkistetaan {len(keys)} luentoa")
+            sources = {}
+            for pub, lang, n in sorted(keys):
+                courseObject = courses[pub]
+                if (pub, lang) not in sources:
+                    print(f"\\_{config[pub]['coursename']} [{lang or 'fi'}]")
+                    sources[(pub, lang)] = load_lecture_sources(courseObject,config,lang)
+                # The published folder has changed if something was uploaded since the last scan
+                directory_index.invalidate(lecture_dir(courseObject,n))
+                if sources[(pub, lang)] is None:
+                    continue
+                unit = plan_lecture(courseObject,config,pub,lang,n,sources[(pub, lang)],manifest,silent)
+                if unit is None:
+                    index.update(plan_lecture_output(courseObject,config,pub,lang,n,sources[(pub, lang)],manifest))
+                    continue
+                index.update(unit)
+                unit["staging"] = str(uploader.staging_path(unit["output"]))
+                ok, log, stats = run_lecture_unit(unit,silent)
+                metrics.merge(stats)
+                for line in log:
+                    print(line)
+                if ok:
+                    upload_lecture(unit,manifest,uploader)
+            for pub, lang in sources:
+                directory_index.invalidate(courses[pub].publication_dir)
+                publish_compendium(courses[pub],config,pub,lang,manifest,uploader,silent)
+            # Material folders, a change anywhere below a lecture's folder syncs the course
+            for pub, courseObject in courses.items():
+                if lectures_under(changed, roots[pub]):
+                    directory_index.invalidate()
+                    print(f"\\_Tarkistetaan materiaalikansiot ({config[pub]['coursename']})")
+                    publish_materials(courseObject,config,uploader,manifest,silent)
+            uploader.wait()
+            manifest.save()
+    except KeyboardInterrupt:
+        print("\nSeuranta lopetettu")
+    finally:
+        watcher.stop()
 
     
 #############################################################################
@@ -339,13 +807,24 @@ if __name__ == "__main__":
     parser.add_argument("--linkcheck", "-l", action="store_true", help="Run link health check")
     parser.add_argument("--silent", "-s", action="store_true", help="Silent mode, minimal output")
     parser.add_argument("--checkfile", "-f", type=str, help="Check links in a specific PDF file")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Assemble lectures in N parallel processes")
+    parser.add_argument("--watch", "-w", action="store_true", help="Keep running and republish lectures when their inputs change")
+    parser.add_argument("--metrics", "-m", action="store_true", help="Record time, bytes and pages per stage and lecture to JSON and Prometheus files")
+    parser.add_argument("--linkreport", nargs="?", const="", metavar="COURSE", help="Print the dead links found by earlier checks, optionally of one course only")
+    parser.add_argument("--since", type=str, metavar="DATE", help="With --linkreport, only links that started failing on or after DATE (YYYY-MM-DD)")
+    parser.add_argument("--plan", nargs="?", const="text", choices=["text", "json"], help="Print the build plan without reading or writing any PDF")
     args = parser.parse_args()
     
     silent = args.silent
 
     (config, publications) = load_config()
-    if not silent:
+    # --plan json writes nothing but the plan to stdout
+    if not silent and args.plan != "json":
         print("Config loaded successfully!")
+    configure_reader_cache(config)
+    configure_link_checker(config)
+    if int(config['settings']['image_max_dpi']) and Image is None and not args.plan:
+        print("[WARNING] image_max_dpi is set but Pillow is not installed, images are not downsampled")
 
 
     if args.checkfile:
@@ -353,20 +832,67 @@ if __name__ == "__main__":
             print("Tarkistetaan linkit tiedostosta:", args.checkfile)
         checkLinksOnFile(args.checkfile, silent)
     
+    #Dead link report
+    if args.linkreport is not None:
+        link_report(args.linkreport, args.since)
+
     #link health check
     if args.linkcheck:
         link_health_check(config, publications, silent)
 
+    #Build plan only
+    if args.plan:
+        prefetch_directories(config,publications)
+        plan = build_plan(config,publications,load_manifest(config))
+        print(plan_to_json(plan) if args.plan == "json" else format_plan(plan))
+        sys.exit(0)
+
     #Main program
+    metrics.enabled = args.metrics
+    with metrics.stage("scan"):
+        prefetch_directories(config,publications)
+    manifest = load_manifest(config)
+    uploader = create_uploader(config)
+    units = []
     for pub in publications:
         if not silent:
             print(f"*****************************************\nTarkistetaan {config[pub]['coursename']}")
         courseObject = create_course_object(config, pub)
         print(f"\\_Tarkistetaan suomenkieliset luennot")
-        publish_lectures(courseObject,config,"")
+        if args.jobs > 1:
+            units += plan_lectures(courseObject,config,pub,"",manifest,silent)
+        else:
+            publish_lectures(courseObject,config,pub,"",manifest,uploader,silent)
         if not config[pub]['translate_to'] == "":
             for lang in config[pub]['translate_to'].split(","):
                 print(f"\\_Tarkistetaan käännökset fi->{lang}")
-                publish_lectures(courseObject,config,lang)
-        print(f"\\_Tarkistetaan materiaalikansiot")
-        publish_materials(courseObject,config)
+                if args.jobs > 1:
+                    units += plan_lectures(courseObject,config,pub,lang,manifest,silent)
+                else:
+                    publish_lectures(courseObject,config,pub,lang,manifest,uploader,silent)
+        if args.jobs <= 1:
+            print(f"\\_Tarkistetaan materiaalikansiot")
+            with metrics.stage("materials"):
+                publish_materials(courseObject,config,uploader,manifest,silent)
+
+    if args.jobs > 1:
+        publish_lectures_parallel(units,args.jobs,manifest,uploader,silent)
+        for pub in publications:
+            courseObject = create_course_object(config, pub)
+            print(f"\\_Tarkistetaan materiaalikansiot ({config[pub]['coursename']})")
+            with metrics.stage("materials"):
+                publish_materials(courseObject,config,uploader,manifest,silent)
+    if args.watch:
+        uploader.wait()
+        manifest.save()
+        watch_publications(config,publications,manifest,uploader,silent)
+    with metrics.stage("upload_wait"):
+        uploader.close(silent)
+    manifest.save()
+    if not silent and args.jobs <= 1:
+        print(reader_cache.stats())
+    if args.metrics:
+        metrics.write_json(config['settings']['metrics_json'])
+        metrics.write_prometheus(config['settings']['metrics_textfile'])
+        if not silent:
+            print(f"Mittarit tallennettu: {config['settings']['metrics_json']}, {config['settings']['metrics_textfile']}")
@@ -0,0 +1,80 @@
+import threading
+import time
+from pathlib import Path
+from dirindex import directory_index
+
+#############################################################################
+# Materiaalikansioiden synkronointi
+#############################################################################
+
+def scan_tree(root) -> dict:
+    """Every file below root keyed by its relative path (with / separators), from the directory index."""
+    files = {}
+    todo = [(Path(root), "")]
+    while todo:
+        folder, prefix = todo.pop()
+        for name, entry in directory_index.listing(folder).items():
+            if name.startswith(".") and name.endswith(".part"):
+                continue
+            rel = f"{prefix}{name}"
+            if entry["is_dir"]:
+                todo.append((entry["file"], f"{rel}/"))
+            else:
+                files[rel] = entry
+    return files
+
+def source_available(root) -> bool:
+    """False if neither root nor the folder above it exists.
+
+    The directory index lists a missing folder as empty, so an unmounted
+    share would look like a material folder whose files were all removed.
+    A missing NN folder under an existing slide folder has no materials.
+    """
+    root = Path(root)
+    return root.is_dir() or root.parent.is_dir()
+
+def needs_copy(entry, published, dest, manifest) -> str:
+    """Why a material file must be copied: "new", "changed" or "" if it is up to date.
+
+    Sizes are compared first, equal sizes are compared by content hash. Hashes
+    are cached by (size, mtime), so a share that only rewrites mtimes costs
+    one read of the file instead of a copy on every run.
+    """
+    if published is None:
+        return "new"
+    if published["size"] != entry["size"]:
+        return "changed"
+    if manifest.file_hash(entry["file"]) != manifest.file_hash(dest):
+        return "changed"
+    return ""
+
+class SyncReport:
+    """Bytes and time of the copies queued for one lecture."""
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.failed = 0
+        self.pruned = 0
+        self.start = time.monotonic()
+        self.end = self.start
+        self.futures = []
+        self._lock = threading.Lock()
+
+    def done(self, size):
+        def callback(ok):
+            with self._lock:
+                if ok:
+                    self.files += 1
+                    self.bytes += size
+                else:
+                    self.failed += 1
+                self.end = time.monotonic()
+        return callback
+
+    def wait(self):
+        for future in self.futures:
+            future.exception()
+
+    @property
+    def elapsed(self) -> float:
+        return max(self.end - self.start, 0.0)
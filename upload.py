@@ -0,0 +1,111 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from metrics import metrics
+
+#############################################################################
+# Julkaisukansioon siirto: paikallinen välivaihe, atominen ja uudelleenyrittävä
+#############################################################################
+
+class Uploader:
+    """Copies finished files to the publication share in a bounded thread pool.
+
+    Every upload is written under a temporary name next to the destination and
+    renamed into place, so a broken transfer never leaves a truncated file
+    behind. Failed uploads are retried with exponential backoff.
+    """
+    def __init__(self, staging_dir, workers: int = 4, retries: int = 3, backoff: float = 2.0):
+        self.staging_dir = Path(staging_dir)
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+        self.retries = retries
+        self.backoff = backoff
+        self.uploaded = 0
+        self.bytes = 0
+        self.failed = []
+        self._futures = []
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload")
+
+    def staging_path(self, dest) -> Path:
+        """Local path where an output for dest should be written before uploading."""
+        key = hashlib.sha1(str(dest).encode()).hexdigest()[:12]
+        return self.staging_dir / f"{key}_{Path(dest).name}"
+
+    def submit(self, src, dest, on_done=None, remove_src=False, label=None):
+        """Queue src to be uploaded to dest.
+
+        on_done(ok) is called from the upload thread when the transfer has
+        finished or finally failed. With remove_src the source (a staged file)
+        is deleted afterwards. label names the lecture in the run metrics.
+        """
+        future = self._pool.submit(self._upload, Path(src), Path(dest), on_done, remove_src, label)
+        with self._lock:
+            self._futures.append(future)
+        return future
+
+    def _upload(self, src, dest, on_done, remove_src, label):
+        tmp = dest.with_name(f".{dest.name}.part")
+        error = None
+        start = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            try:
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(src, tmp)
+                os.replace(tmp, dest)
+                error = None
+                break
+            except OSError as e:
+                error = e
+                try:
+                    tmp.unlink(missing_ok=True)
+                except OSError:
+                    pass
+                if attempt < self.retries:
+                    time.sleep(self.backoff * (2 ** attempt))
+        ok = error is None
+        size = src.stat().st_size if ok else 0
+        metrics.add("upload", label, time.perf_counter() - start, bytes_read=size, bytes_written=size)
+        with self._lock:
+            if ok:
+                self.uploaded += 1
+                self.bytes += size
+            else:
+                self.failed.append((dest, error))
+        if remove_src:
+            try:
+                src.unlink(missing_ok=True)
+            except OSError:
+                pass
+        if on_done is not None:
+            on_done(ok)
+        return ok
+
+    def wait(self):
+        """Block until every queued upload has finished."""
+        while True:
+            with self._lock:
+                pending = [f for f in self._futures if not f.done()]
+                if not pending:
+                    self._futures.clear()
+                    return
+            for future in pending:
+                future.exception()
+
+    def close(self, silent=False):
+        """Finish all uploads, print a summary and shut the pool down."""
+        self.wait()
+        self._pool.shutdown()
+        for dest, error in self.failed:
+            print(f"\033[31m❌ Error: Uploading '{dest.name}' failed after {self.retries + 1} attempts: {error}\033[0m")
+        if not silent and (self.uploaded or self.failed):
+            print(f"Siirretty {self.uploaded} tiedostoa ({self.bytes / 1048576:.1f} MB), {len(self.failed)} epäonnistui")
+
+def create_uploader(config) -> Uploader:
+    return Uploader(config["settings"]["staging_dir"],
+                    workers=int(config["settings"]["upload_workers"]),
+                    retries=int(config["settings"]["upload_retries"]),
+                    backoff=float(config["settings"]["upload_backoff"]))
@@ -1,12 +1,39 @@
-import requests
+import multiprocessing
 from datetime import datetime, timezone
-from typing import Set, Iterable, List, Tuple, Dict
+from pathlib import Path
+from typing import Callable, Iterable, List, Tuple, Dict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pypdf import PdfReader
+from database import transaction
+from linkcheck import link_checker
+
+
+def _page_annotations(node, visited):
+    """Yield the /Annots array (or None) of every page under a page tree node, in page order.
+
+    Only the tree nodes and the annotation arrays are resolved, page contents
+    and resources are never read.
+    """
+    node = node.get_object()
+    kids = node.get("/Kids")
+    if kids is None:
+        yield node.get("/Annots")
+        return
+    for kid in kids:
+        ref = getattr(kid, "idnum", None)
+        if ref is not None:
+            if ref in visited:
+                continue
+            visited.add(ref)
+        yield from _page_annotations(kid, visited)
 
 
 def find_links(file: str) -> List[Dict]:
     """Extract link annotations from a PDF.
 
+    The file is read lazily through a file handle, so only the page tree and
+    the annotations are loaded from disk.
+
     Args:
         file: Path to the PDF file.
 
@@ -16,31 +43,68 @@ def find_links(file: str) -> List[Dict]:
         - "file" (str): the source PDF filename passed in
         - "page_number" (int): 1-based page index where the link was found
     """
-    reader = PdfReader(file)
     key = '/Annots'
     uri = '/URI'
     ank = '/A'
     links = []
 
-    for page_index, page in enumerate(reader.pages):
-        annotations = page.get(key)
-        if not annotations:
-            continue
-        for annot in annotations:
+    with open(file, "rb") as f:
+        reader = PdfReader(f)
+        pages = reader.trailer["/Root"]["/Pages"]
+        for page_index, annotations in enumerate(_page_annotations(pages, set())):
+            if not annotations:
+                continue
+            for annot in annotations.get_object():
+                try:
+                    u = annot.get_object()
+                    action = u.get(ank)
+                    action = action.get_object() if action is not None else None
+                except Exception as e:
+                    print(f"Error getting annotation object on page {page_index}: {e}")
+                    continue
+                if action is not None and uri in action:
+                    url = action[uri]
+                    links.append({"url": str(url), "file": file, "page_number": page_index + 1, "error_code": None})
+    return links
+
+
+def extract_links(files: Iterable[str], workers: int, extract: Callable = find_links) -> Iterable[Tuple[str, object]]:
+    """Yield (file, extract(file)) for every file, extracted in a pool of worker processes.
+
+    Files are yielded as soon as they have been read, not in input order, so
+    a consumer such as test_link starts checking while the other files are
+    still being parsed. Files that cannot be read are reported and skipped.
+    extract must be a module level function, the workers import it.
+    """
+    files = list(files)
+    if workers <= 1 or len(files) <= 1:
+        for file in files:
             try:
-                u = annot.get_object()
+                links = extract(file)
             except Exception as e:
-                print(f"Error getting annotation object on page {page_index}: {e}")
+                print(f"[WARNING] Could not read links of {file}: {e}")
                 continue
-            if ank in u and uri in u[ank]:
-                url = u[ank][uri]
-                links.append({"url": url, "file": file, "page_number": page_index + 1, "error_code": None})
-    return links
+            yield file, links
+        return
+    # The link checker threads are already running, forking them is not safe
+    with ProcessPoolExecutor(max_workers=min(workers, len(files)), mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(extract, file): file for file in files}
+        for future in as_completed(futures):
+            file = futures[future]
+            try:
+                links = future.result()
+            except Exception as e:
+                print(f"[WARNING] Could not read links of {file}: {e}")
+                continue
+            yield file, links
 
 
 def test_link(links: Iterable[Dict]) -> Tuple[List[Dict], List[Dict]]:
     """Check HTTP status for each link dict.
 
+    The links are checked concurrently by the shared link checker, which
+    limits the requests in flight in total and per host.
+
     Args:
         links: Iterable of dicts like {"url": str, "file": str, "page_number": int}.
 
@@ -48,55 +112,83 @@ def test_link(links: Iterable[Dict]) -> Tuple[List[Dict], List[Dict]]:
         Tuple(dead_links, alive_links) where each element is a list of the
         original dicts that were determined dead or alive, respectively.
     """
-    seen: Set[Tuple[str, str, int]] = set()
-    dead_links: List[Dict] = []
-    alive_links: List[Dict] = []
-
-    for item in links:
-        if not isinstance(item, dict):
-            continue
-        url = item.get("url")
-        if not url:
-            continue
-        key = (url, item.get("file"), item.get("page_number"))
-        if key in seen:
-            continue
-        seen.add(key)
-        try:
-            resp = requests.get(url, allow_redirects=True, timeout=5, auth=None, headers={'User-Agent': 'Mozilla/5.0'})
-            if resp.status_code >= 500 or resp.status_code == 404:
-                item.update({"error_code": resp.status_code})
-                dead_links.append(item)
-            elif resp.status_code >= 400:
-                item.update({"error_code": resp.status_code})
-                continue
-            else:
-                alive_links.append(item)
-        except requests.RequestException:
-            item.update({"error_code": "timeout"})
-            dead_links.append(item)
-
-    return dead_links, alive_links
+    return link_checker.check(links)
 
-def add_dead_links_to_db(cursor, file, dead_links):
+def record_link_status(conn, files: Dict[str, str], dead_links: List[Dict], alive_links: List[Dict]):
+    """Upsert the result of a link check run into link_status in one transaction.
 
-    check_time = datetime.now(timezone.utc).strftime("%Y-%m-%d-%H-%M-%S")
+    Args:
+        conn: The database connection, see database.get_db().
+        files: Every checked file mapped to its course name (or None).
+        dead_links, alive_links: The lists returned by test_link.
+
+    A link that fails keeps the time of its first failure and its count of
+    failed checks grows, a working link clears both. An inferred result
+    leaves both as they were, the link was not requested. Rows of the checked
+    files and courses that were not seen in this run belong to links or files
+    that have been removed, they are deleted. Files are stored by their
+    absolute path, however they were given on the command line.
+    """
+    check_time = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    paths = {file: str(Path(file).resolve()) for file in files}
     rows = []
-
-    for item in dead_links:
-        url = item.get("url")
-        if not url:
-            continue
-        page = item.get("page_number")
-        error_code = item.get("error_code")
-        rows.append((error_code, file, url, page, check_time))
-
-    if rows:
+    for status, items in (("dead", dead_links), ("alive", alive_links)):
+        for item in items:
+            url = item.get("url")
+            if not url:
+                continue
+            file = item.get("file")
+            error_code = item.get("error_code") if status == "dead" else None
+            # An inferred result was never requested, it does not count as a failed check
+            failed = status == "dead" and not item.get("inferred")
+            rows.append((url, paths.get(file) or str(Path(file).resolve()), item.get("page_number"), files.get(file), status,
+                         None if error_code is None else str(error_code), item.get("response_ms"),
+                         check_time if failed else None, check_time, int(failed),
+                         int(bool(item.get("inferred")))))
+
+    with transaction(conn) as cursor:
         cursor.executemany(
-            "INSERT INTO dead_links (error_code, file, url, page_number, checked_at) VALUES (?, ?, ?, ?, ?)",
+            """INSERT INTO link_status (url, file, page_number, course, status, error_code, response_ms,
+                                        first_failed, last_checked, fail_count, inferred)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (url, file, page_number) DO UPDATE SET
+                   course = COALESCE(excluded.course, link_status.course),
+                   status = excluded.status,
+                   error_code = excluded.error_code,
+                   response_ms = excluded.response_ms,
+                   first_failed = CASE WHEN excluded.inferred = 1 THEN link_status.first_failed
+                                       WHEN excluded.status = 'dead'
+                                       THEN COALESCE(link_status.first_failed, excluded.first_failed) END,
+                   last_checked = excluded.last_checked,
+                   fail_count = CASE WHEN excluded.inferred = 1 THEN link_status.fail_count
+                                     WHEN excluded.status = 'dead' THEN link_status.fail_count + 1 ELSE 0 END,
+                   inferred = excluded.inferred""",
             rows,
         )
-        cursor.connection.commit()
+        cursor.executemany("DELETE FROM link_status WHERE file = ? AND last_checked < ?",
+                           [(path, check_time) for path in paths.values()])
+        cursor.executemany("DELETE FROM link_status WHERE course = ? AND last_checked < ?",
+                           [(course, check_time) for course in set(files.values()) if course is not None])
+
+def query_dead_links(conn, course: str = None, since: str = None) -> List[Tuple]:
+    """Dead links as (course, file, page_number, url, error_code, first_failed, last_checked, fail_count, inferred).
+
+    course limits the result to one course, since (an ISO date or time) to
+    links that started failing then or later. Sorted by course, oldest failures
+    first. Links only inferred dead have no first_failed, they come last and
+    count as failing since the check that inferred them.
+    """
+    sql = """SELECT course, file, page_number, url, error_code, first_failed, last_checked, fail_count, inferred
+             FROM link_status WHERE status = 'dead'"""
+    params = []
+    if course is not None:
+        sql += " AND course = ?"
+        params.append(course)
+    if since is not None:
+        sql += " AND (first_failed >= ? OR (first_failed IS NULL AND last_checked >= ?))"
+        params += [since, since]
+    sql += " ORDER BY course, first_failed IS NULL, first_failed, file, page_number"
+    return conn.execute(sql, params).fetchall()
 
 def run_health_check(file: str):
     links = find_links(file)
@@ -0,0 +1,198 @@
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from buildplan import plan_inputs
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+#############################################################################
+# Muutosten seuranta: käänteinen riippuvuusindeksi ja tapahtumien yhdistely
+#############################################################################
+
+NETWORK_FILESYSTEMS = {"cifs", "smb3", "smbfs", "nfs", "nfs4", "fuse.sshfs", "9p", "davfs", "fuse.rclone"}
+
+def entry_key(entry) -> tuple:
+    return (entry["pub"], entry["lang"], entry["lecture"])
+
+class ReverseIndex:
+    """Maps every input file to the (publication, language, lecture) outputs using it.
+
+    Outputs that wait for a missing input are kept apart, any new file may
+    be the one they are waiting for.
+    """
+    def __init__(self):
+        self.by_input = defaultdict(set)
+        self.inputs = {}
+        self.blocked = set()
+
+    def update(self, entry):
+        key = entry_key(entry)
+        for path in self.inputs.pop(key, ()):
+            self.by_input[path].discard(key)
+        paths = {os.path.normpath(p) for p in plan_inputs(entry)}
+        # Header, divider and footer are watched even when they do not exist yet
+        paths |= {os.path.normpath(entry[role]) for role in ("header", "divider", "footer")}
+        for path in paths:
+            self.by_input[path].add(key)
+        self.inputs[key] = paths
+        if entry["missing"]:
+            self.blocked.add(key)
+        else:
+            self.blocked.discard(key)
+
+    def affected(self, paths) -> set:
+        keys = set()
+        for path in paths:
+            keys |= self.by_input.get(os.path.normpath(path), set())
+        if paths and self.blocked:
+            keys |= self.blocked
+        return keys
+
+class ChangeQueue:
+    """Collects changed paths and hands them out in debounced batches."""
+    def __init__(self):
+        self._paths = set()
+        self._last = 0.0
+        self._cond = threading.Condition()
+
+    def add(self, path):
+        with self._cond:
+            self._paths.add(str(path))
+            self._last = time.monotonic()
+            self._cond.notify()
+
+    def wait_batch(self, debounce: float) -> set:
+        """Block until something changed and nothing more has changed for debounce seconds."""
+        with self._cond:
+            while not self._paths:
+                self._cond.wait()
+            while True:
+                quiet = time.monotonic() - self._last
+                if quiet >= debounce:
+                    break
+                self._cond.wait(debounce - quiet)
+            paths, self._paths = self._paths, set()
+        return paths
+
+def lectures_under(paths, roots: dict) -> set:
+    """Lecture numbers of the material trees in roots ({folder: n}) that contain any of paths."""
+    found = set()
+    for path in paths:
+        path = os.path.normpath(path)
+        for root, n in roots.items():
+            if path == root or path.startswith(root + os.sep):
+                found.add(n)
+    return found
+
+class PollingWatcher(threading.Thread):
+    """Detects changes by comparing (size, mtime) snapshots of the watched folders.
+
+    Only the folder listings are read, which works on any mount. The folders
+    in trees are listed with all their subfolders.
+    """
+    def __init__(self, directories, queue: ChangeQueue, interval: float, trees=()):
+        super().__init__(daemon=True, name="watch-poll")
+        self.directories = list(directories)
+        self.trees = list(trees)
+        self.queue = queue
+        self.interval = interval
+        self._halt = threading.Event()
+        self._snapshot = self._take()
+
+    def _scan(self, d, snapshot, recursive):
+        try:
+            with os.scandir(d) as it:
+                for entry in it:
+                    try:
+                        if entry.is_file():
+                            st = entry.stat()
+                            snapshot[entry.path] = (st.st_size, st.st_mtime_ns)
+                        elif recursive and entry.is_dir(follow_symlinks=False):
+                            self._scan(entry.path, snapshot, recursive)
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+
+    def _take(self) -> dict:
+        snapshot = {}
+        for d in self.directories:
+            self._scan(d, snapshot, False)
+        for d in self.trees:
+            self._scan(d, snapshot, True)
+        return snapshot
+
+    def run(self):
+        while not self._halt.wait(self.interval):
+            current = self._take()
+            for path in current.keys() | self._snapshot.keys():
+                if current.get(path) != self._snapshot.get(path):
+                    self.queue.add(path)
+            self._snapshot = current
+
+    def stop(self):
+        self._halt.set()
+
+class _EventHandler(FileSystemEventHandler):
+    def __init__(self, queue: ChangeQueue):
+        self.queue = queue
+
+    def on_any_event(self, event):
+        # A folder moved or deleted inside a material tree has no events for its files
+        if event.is_directory and event.event_type not in ("created", "deleted", "moved"):
+            return
+        self.queue.add(event.src_path)
+        dest = getattr(event, "dest_path", None)
+        if dest:
+            self.queue.add(dest)
+
+def is_network_mount(path) -> bool:
+    """True if path is on a network filesystem where inotify does not see remote changes."""
+    if not sys.platform.startswith("linux"):
+        return str(path).startswith("\\\\")
+    try:
+        target = os.path.realpath(path)
+        best, fstype = "", ""
+        with open("/proc/mounts") as f:
+            for line in f:
+                parts = line.split()
+                mountpoint = parts[1].replace("\\040", " ")
+                if (target == mountpoint or target.startswith(mountpoint.rstrip("/") + "/")) and len(mountpoint) > len(best):
+                    best, fstype = mountpoint, parts[2]
+        return fstype in NETWORK_FILESYSTEMS
+    except OSError:
+        return False
+
+def start_watcher(directories, queue: ChangeQueue, mode: str, interval: float, trees=()):
+    """Start an event based watcher if possible, otherwise poll. Returns (watcher, description).
+
+    Only the files directly in directories are watched, trees are watched
+    with all their subfolders.
+    """
+    trees = [d for d in dict.fromkeys(os.path.normpath(str(d)) for d in trees) if Path(d).is_dir()]
+    directories = [d for d in dict.fromkeys(os.path.normpath(str(d)) for d in directories)
+                   if Path(d).is_dir() and d not in trees]
+    use_events = mode == "events" or (mode == "auto" and not any(is_network_mount(d) for d in directories + trees))
+    if use_events and Observer is not None:
+        observer = Observer()
+        handler = _EventHandler(queue)
+        for d in directories:
+            observer.schedule(handler, d, recursive=False)
+        for d in trees:
+            observer.schedule(handler, d, recursive=True)
+        try:
+            observer.start()
+            return observer, "tapahtumat"
+        except OSError:
+            pass
+    watcher = PollingWatcher(directories, queue, interval, trees)
+    watcher.start()
+    return watcher, f"kysely {interval:g} s välein"